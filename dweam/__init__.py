@@ -1,5 +1,29 @@
-from dweam.game import Game
-from dweam.models import GameInfo, Field
-from dweam.utils.entrypoint import get_cache_dir
+import importlib
+from typing import TYPE_CHECKING, Any
 
-__all__ = ["Game", "GameInfo", "Field", "get_cache_dir"]
+# Exports are imported on first access, so that importing a lightweight submodule
+# (e.g. from the worker process before it has connected) doesn't pull in pygame
+_EXPORTS = {
+    "Game": "dweam.game",
+    "GameInfo": "dweam.models",
+    "Field": "dweam.models",
+    "get_cache_dir": "dweam.utils.entrypoint",
+    "YUV420Frame": "dweam.utils.frame",
+}
+
+if TYPE_CHECKING:
+    from dweam.game import Game
+    from dweam.models import GameInfo, Field
+    from dweam.utils.entrypoint import get_cache_dir
+    from dweam.utils.frame import YUV420Frame
+
+__all__ = ["Game", "GameInfo", "Field", "get_cache_dir", "YUV420Frame"]
+
+
+def __getattr__(name: str) -> Any:
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,291 @@
+import asyncio
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any
+
+from structlog.stdlib import BoundLogger
+
+from dweam.utils.memory import total_memory_mb
+from dweam.worker import GameWorker
+from dweam.worker_pool import WorkerPool
+
+
+GameKey = tuple[str, str]  # (game type, game id)
+
+
+@dataclass
+class GameCost:
+    """Estimated resources a session of a game uses"""
+    memory_mb: float
+    cores: float
+    samples: int = 0
+
+
+@dataclass
+class Ticket:
+    """A session's place in the admission queue, and then its share of the host"""
+    session_id: str
+    key: GameKey
+    enqueued_at: float  # time.monotonic()
+    admitted_at: float | None = None
+    admitted: asyncio.Event = field(default_factory=asyncio.Event)
+    worker: GameWorker | None = None
+
+
+class AdmissionController:
+    """
+    Admits sessions while the host has capacity for them, and queues the rest in arrival order.
+
+    Each session is charged its game's estimated cost: the memory (PSS, or RSS where that isn't
+    available) and CPU cores (step time times frame rate) measured from the game's running sessions,
+    or the defaults until one has run. The queue is first come, first served, so that a big game
+    isn't starved by smaller ones behind it. Idle pooled workers are charged their game's memory
+    (but no cores), which a session claiming one takes over.
+    """
+
+    # How often running sessions are measured, in seconds
+    SAMPLE_INTERVAL = 10.0
+    # Weight of a new measurement in a game's cost estimate
+    SMOOTHING = 0.3
+
+    def __init__(
+        self,
+        log: BoundLogger,
+        memory_mb: float | None,
+        cores: float,
+        default_memory_mb: float = 2048.0,
+        default_cores: float = 1.0,
+        enabled: bool = True,
+        pool: WorkerPool | None = None,
+    ):
+        self.log = log.bind(component="admission")
+        self.memory_mb = memory_mb
+        self.cores = cores
+        self.default_memory_mb = default_memory_mb
+        self.default_cores = default_cores
+        self.enabled = enabled
+        self.pool = pool
+
+        self._costs: dict[GameKey, GameCost] = {}
+        self._queue: deque[Ticket] = deque()
+        self._admitted: dict[str, Ticket] = {}
+        # Running average of how long admitted sessions last, in seconds
+        self._session_duration: float | None = None
+        self._task: asyncio.Task | None = None
+
+    @classmethod
+    def from_env(cls, log: BoundLogger, pool: WorkerPool | None = None) -> "AdmissionController":
+        """
+        Configure admission from `ADMISSION_MEMORY_MB` and `ADMISSION_CPU_CORES` (by default, 90% of the
+        host's memory and all of its cores), `ADMISSION_DEFAULT_MEMORY_MB` and `ADMISSION_DEFAULT_CORES`
+        (the cost of games not measured yet); set `ADMISSION_CONTROL=0` to admit every session
+        """
+        memory_mb = os.environ.get("ADMISSION_MEMORY_MB")
+        host_memory_mb = total_memory_mb()
+        return cls(
+            log,
+            memory_mb=float(memory_mb) if memory_mb else (host_memory_mb * 0.9 if host_memory_mb else None),
+            cores=float(os.environ.get("ADMISSION_CPU_CORES", os.cpu_count() or 1)),
+            default_memory_mb=float(os.environ.get("ADMISSION_DEFAULT_MEMORY_MB", 2048)),
+            default_cores=float(os.environ.get("ADMISSION_DEFAULT_CORES", 1)),
+            enabled=os.environ.get("ADMISSION_CONTROL", "1") != "0",
+            pool=pool,
+        )
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._sample())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def cost(self, key: GameKey) -> GameCost:
+        """The estimated cost of a session of a game"""
+        return self._costs.get(key) or GameCost(memory_mb=self.default_memory_mb, cores=self.default_cores)
+
+    def usage(self) -> tuple[float, float]:
+        """Memory (MiB) and cores charged to admitted sessions and idle pooled workers"""
+        memory_mb = cores = 0.0
+        for ticket in self._admitted.values():
+            cost = self.cost(ticket.key)
+            memory_mb += cost.memory_mb
+            cores += cost.cores
+        return memory_mb + self._pooled_memory_mb(), cores
+
+    def _pooled_memory_mb(self) -> float:
+        if self.pool is None:
+            return 0.0
+        memory_mb = 0.0
+        for key, count in self.pool.reserved().items():
+            # Admitted sessions about to claim an idle worker are charged for it already
+            claimed = min(self.pool.idle_count(key), self._unstarted(key))
+            memory_mb += self.cost(key).memory_mb * (count - claimed)
+        return memory_mb
+
+    def _unstarted(self, key: GameKey) -> int:
+        """Sessions of a game admitted, but without a worker yet"""
+        return sum(1 for ticket in self._admitted.values() if ticket.key == key and ticket.worker is None)
+
+    def has_room_for_pooled(self, key: GameKey) -> bool:
+        """Whether the pool may start another idle worker for a game, without holding up queued sessions"""
+        if not self.enabled or self.memory_mb is None:
+            return True
+        if self._queue:
+            return False
+        memory_mb, _ = self.usage()
+        return memory_mb + self.cost(key).memory_mb <= self.memory_mb
+
+    def request(self, session_id: str, game_type: str, game_id: str) -> Ticket:
+        """Queue a session for admission; its ticket's `admitted` event is set once it may start"""
+        ticket = Ticket(session_id=session_id, key=(game_type, game_id), enqueued_at=time.monotonic())
+        self._queue.append(ticket)
+        self._admit_waiting()
+        if not ticket.admitted.is_set():
+            self.log.info(
+                "Session queued",
+                session_id=session_id,
+                game_type=game_type,
+                game_id=game_id,
+                position=self.position(ticket),
+            )
+        return ticket
+
+    def attach(self, session_id: str, worker: GameWorker) -> None:
+        """Set the worker of an admitted session, so its resource use can be measured"""
+        ticket = self._admitted.get(session_id)
+        if ticket is not None:
+            ticket.worker = worker
+
+    def release(self, session_id: str) -> None:
+        """Free an admitted session's share of the host, or take it out of the queue"""
+        ticket = self._admitted.pop(session_id, None)
+        if ticket is not None:
+            assert ticket.admitted_at is not None
+            duration = time.monotonic() - ticket.admitted_at
+            if self._session_duration is None:
+                self._session_duration = duration
+            else:
+                self._session_duration += (duration - self._session_duration) * self.SMOOTHING
+        else:
+            self._queue = deque(queued for queued in self._queue if queued.session_id != session_id)
+        self._admit_waiting()
+
+    def position(self, ticket: Ticket) -> int:
+        """1-based position of a queued session, or 0 once it's admitted"""
+        if ticket.admitted.is_set():
+            return 0
+        for position, queued in enumerate(self._queue, start=1):
+            if queued is ticket:
+                return position
+        return 0
+
+    def eta(self, ticket: Ticket) -> float | None:
+        """
+        Rough number of seconds until a queued session is admitted, assuming a slot frees up every
+        (average session duration / admitted sessions) seconds, or None if no session has ended yet
+        """
+        position = self.position(ticket)
+        if position == 0:
+            return 0.0
+        if self._session_duration is None:
+            return None
+        return position * self._session_duration / max(1, len(self._admitted))
+
+    def _fits(self, ticket: Ticket) -> bool:
+        if not self.enabled or not self._admitted:
+            # A session too big for the host on its own still gets to run once nothing else is
+            return True
+        memory_mb, cores = self.usage()
+        cost = self.cost(ticket.key)
+        # A session that will claim an idle pooled worker takes over the memory already charged for it
+        new_memory_mb = 0.0 if self._claimable(ticket.key) > 0 else cost.memory_mb
+        if self.memory_mb is not None and memory_mb + new_memory_mb > self.memory_mb:
+            return False
+        return cores + cost.cores <= self.cores
+
+    def _claimable(self, key: GameKey) -> int:
+        """Idle pooled workers of a game not spoken for by sessions admitted but not started yet"""
+        if self.pool is None:
+            return 0
+        return self.pool.idle_count(key) - self._unstarted(key)
+
+    def _admit_waiting(self) -> None:
+        while self._queue and self._fits(self._queue[0]):
+            ticket = self._queue.popleft()
+            ticket.admitted_at = time.monotonic()
+            self._admitted[ticket.session_id] = ticket
+            ticket.admitted.set()
+            if ticket.admitted_at - ticket.enqueued_at > 0.1:
+                self.log.info(
+                    "Session admitted",
+                    session_id=ticket.session_id,
+                    waited_s=ticket.admitted_at - ticket.enqueued_at,
+                )
+
+    def _record(self, key: GameKey, memory_mb: float | None, cores: float | None) -> None:
+        cost = self._costs.get(key)
+        if cost is None:
+            if memory_mb is None or cores is None:
+                return
+            self._costs[key] = GameCost(memory_mb=memory_mb, cores=cores, samples=1)
+            return
+        if memory_mb is not None:
+            cost.memory_mb += (memory_mb - cost.memory_mb) * self.SMOOTHING
+        if cores is not None:
+            cost.cores += (cores - cost.cores) * self.SMOOTHING
+        cost.samples += 1
+
+    async def _measure(self, ticket: Ticket) -> None:
+        assert ticket.worker is not None
+        stats = await asyncio.wait_for(ticket.worker.get_stats(), timeout=5.0)
+        if not stats:
+            return
+        memory = stats.get("memory") or {}
+        process_mb = memory.get("pss_mb") or memory.get("rss_mb")
+        memory_mb = process_mb / max(1, stats.get("sessions") or 1) if process_mb else None
+        frame_rate = stats.get("frame_rate") or {}
+        step_ms = frame_rate.get("step_ms")
+        fps = frame_rate.get("fps")
+        cores = step_ms / 1000 * fps if step_ms is not None and fps else None
+        self._record(ticket.key, memory_mb, cores)
+
+    async def _sample(self) -> None:
+        while True:
+            await asyncio.sleep(self.SAMPLE_INTERVAL)
+            tickets = [
+                ticket for ticket in self._admitted.values()
+                if ticket.worker is not None and ticket.worker.is_alive
+            ]
+            results = await asyncio.gather(*[self._measure(ticket) for ticket in tickets], return_exceptions=True)
+            for ticket, result in zip(tickets, results):
+                if isinstance(result, Exception):
+                    self.log.debug("Failed to measure session", session_id=ticket.session_id, error=str(result))
+            # Estimates may have shrunk
+            self._admit_waiting()
+
+    def stats(self) -> dict[str, Any]:
+        memory_mb, cores = self.usage()
+        return {
+            "enabled": self.enabled,
+            "capacity": {"memory_mb": self.memory_mb, "cores": self.cores},
+            "usage": {"memory_mb": memory_mb, "cores": cores, "pooled_memory_mb": self._pooled_memory_mb()},
+            "admitted": len(self._admitted),
+            "queued": len(self._queue),
+            "session_duration_s": self._session_duration,
+            "games": {
+                f"{game_type}/{game_id}": {
+                    "memory_mb": cost.memory_mb,
+                    "cores": cost.cores,
+                    "samples": cost.samples,
+                }
+                for (game_type, game_id), cost in self._costs.items()
+            },
+        }
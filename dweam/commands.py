@@ -1,32 +1,98 @@
-from typing import Literal, Any
+from pathlib import Path
+from typing import Literal, Any, get_args
 from pydantic import BaseModel
 
-class SchemaCommand(BaseModel):
+from dweam.models import GameInfo
+
+class GameEntrypoint(BaseModel):
+    """The game a worker runs, as already resolved by the server, so the worker needn't scan all packages"""
+    entrypoint: str
+    module_dir: Path | None = None
+    game_info: GameInfo
+
+class BaseCommand(BaseModel):
+    # Matches the response to the command, as a worker may answer commands out of order
+    request_id: int | None = None
+    # The session the command is for, in workers hosting multiple sessions
+    session_id: str | None = None
+
+class SchemaCommand(BaseCommand):
     cmd: Literal["schema"] = "schema"
 
-class StopCommand(BaseModel):
+class StopCommand(BaseCommand):
+    """Stop the session, or the whole worker if no session is given"""
     cmd: Literal["stop"] = "stop"
 
-class UpdateParamsCommand(BaseModel):
+class UpdateParamsCommand(BaseCommand):
     cmd: Literal["update"] = "update"
     data: dict[str, Any]
 
+class SetQualityCommand(BaseCommand):
+    cmd: Literal["quality"] = "quality"
+    tier: Literal["auto", "native", "three_quarters", "half"]
+
+class StatsCommand(BaseCommand):
+    cmd: Literal["stats"] = "stats"
+
+class PrepareCommand(BaseCommand):
+    """Construct the game ahead of the offer, so a pooled worker can answer it immediately"""
+    cmd: Literal["prepare"] = "prepare"
+
+class PingCommand(BaseCommand):
+    """Checks the worker is responsive; answered with the sessions it's running"""
+    cmd: Literal["ping"] = "ping"
+
+class SuspendCommand(BaseCommand):
+    """Saves the session's game state to `path` and ends the session, so it can be resumed in another worker"""
+    cmd: Literal["suspend"] = "suspend"
+    path: Path
+
+class CpuBudgetCommand(BaseCommand):
+    """Sets the compute threads the worker process may use, and the CPUs it's pinned to (None for any)"""
+    cmd: Literal["cpu_budget"] = "cpu_budget"
+    threads: int
+    cpus: list[int] | None = None
+
 class OfferData(BaseModel):
     sdp: str
     type: str
 
-class HandleOfferCommand(BaseModel):
+class HandleOfferCommand(BaseCommand):
     cmd: Literal["handle_offer"] = "handle_offer"
     data: OfferData
+    # Game state saved by a `SuspendCommand`, to restore before the game starts
+    snapshot: Path | None = None
 
-Command = SchemaCommand | StopCommand | UpdateParamsCommand | HandleOfferCommand
+Command = SchemaCommand | StopCommand | UpdateParamsCommand | HandleOfferCommand | StatsCommand | SetQualityCommand | PrepareCommand | PingCommand | SuspendCommand | CpuBudgetCommand
 
-class SuccessResponse(BaseModel):
+class BaseResponse(BaseModel):
+    request_id: int | None = None
+    session_id: str | None = None
+
+class SuccessResponse(BaseResponse):
     status: Literal["success"] = "success"
     data: Any | None = None
 
-class ErrorResponse(BaseModel):
+class ErrorResponse(BaseResponse):
     status: Literal["error"] = "error"
     error: str
 
-Response = SuccessResponse | ErrorResponse 
\ No newline at end of file
+Response = SuccessResponse | ErrorResponse 
+
+# Phases of starting up a session, in the order they normally happen
+StartupPhase = Literal["spawned", "imports_done", "model_loaded", "first_frame", "answer_ready"]
+STARTUP_PHASES: tuple[StartupPhase, ...] = get_args(StartupPhase)
+
+class PhaseEvent(BaseResponse):
+    """Sent by the worker, unprompted, as it completes each startup phase"""
+    status: Literal["phase"] = "phase"
+    phase: StartupPhase
+    timestamp: float  # time.time() in the worker when the phase completed
+    duration: float | None = None  # Seconds the phase took, where the worker can tell
+
+class ExitEvent(BaseResponse):
+    """Sent by the worker when it exits on purpose, so the server can tell its exit from a crash"""
+    status: Literal["exit"] = "exit"
+    reason: str
+
+WorkerMessage = SuccessResponse | ErrorResponse | PhaseEvent | ExitEvent
@@ -1,3 +1,6 @@
+from enum import IntEnum
+import struct
+
 import pygame
 
 
@@ -46,3 +49,30 @@ JS_TO_PYGAME_BUTTON_MAP = {
     2: pygame.BUTTON_RIGHT,  # Right button
     # Add additional mappings if needed
 }
+
+
+class InputType(IntEnum):
+    """Event types of the binary input protocol"""
+    KEYDOWN = 1
+    KEYUP = 2
+    MOUSEMOVE = 3
+    MOUSEDOWN = 4
+    MOUSEUP = 5
+
+
+# Input protocol names, as negotiated with the client over the data channel, most preferred first
+INPUT_PROTOCOL_BINARY = "binary-v2"
+INPUT_PROTOCOL_JSON = "json"
+
+# Binary input message: type (u8), key/button code (u16), movement x/y (i16), client timestamp in ms (f64),
+# and the client's input sequence number (u32)
+INPUT_STRUCT = struct.Struct("<BHhhdI")
+
+# Mapping from the JSON input protocol's event names to binary event types
+JSON_INPUT_TYPES = {
+    "keydown": InputType.KEYDOWN,
+    "keyup": InputType.KEYUP,
+    "mousemove": InputType.MOUSEMOVE,
+    "mousedown": InputType.MOUSEDOWN,
+    "mouseup": InputType.MOUSEUP,
+}
@@ -0,0 +1,311 @@
+"""
+Fork-server mode for game workers.
+
+A template process per game imports the game module and calls `Game.preload` once, then forks a
+worker for every session. Memory loaded before the fork (such as model weights) is shared between
+sessions copy-on-write, instead of every session loading its own copy.
+
+Only available where `os.fork` is (i.e. not on Windows), and enabled with `WORKER_FORK_SERVER=1`.
+Since the template forks, games must not initialize CUDA or start threads in `preload`.
+"""
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+
+from structlog.stdlib import BoundLogger
+
+from dweam.commands import GameEntrypoint
+
+
+# Written to stdout by the template once it's ready to fork workers
+READY_LINE = "FORK SERVER READY"
+# Position of the control channel argument in a worker's argv (see `game_process.main`)
+CONTROL_ARG = 4
+
+
+def fork_server_enabled() -> bool:
+    return os.environ.get("WORKER_FORK_SERVER") == "1" and hasattr(os, "fork")
+
+
+class ForkedProcess:
+    """
+    Handle for a worker forked by a fork server, with the parts of `asyncio.subprocess.Process` that `GameWorker` uses.
+
+    The worker is a child of the template rather than of the server, so its exit status isn't known;
+    `returncode` is -1 once it has exited.
+    """
+
+    stdin = None
+    stdout = None
+    stderr = None
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self._returncode: int | None = None
+
+    @property
+    def returncode(self) -> int | None:
+        if self._returncode is None:
+            try:
+                os.kill(self.pid, 0)
+            except (ProcessLookupError, PermissionError):
+                self._returncode = -1
+        return self._returncode
+
+    async def wait(self) -> int:
+        while self.returncode is None:
+            await asyncio.sleep(0.1)
+        return self._returncode  # type: ignore[return-value]
+
+    def _signal(self, signum: int) -> None:
+        try:
+            os.kill(self.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def terminate(self) -> None:
+        self._signal(signal.SIGTERM)
+
+    def kill(self) -> None:
+        self._signal(signal.SIGKILL)
+
+
+class ForkServer:
+    """Server-side handle for the template process of one game"""
+
+    # Preloading may include loading model weights
+    STARTUP_TIMEOUT = 600.0
+
+    def __init__(self, log: BoundLogger, venv_python: Path, script: Path, game_id: str, entrypoint: GameEntrypoint):
+        self.log = log.bind(fork_server=entrypoint.entrypoint, game_id=game_id)
+        self.venv_python = venv_python
+        self.script = script
+        self.game_id = game_id
+        self.entrypoint = entrypoint
+        # Kept short, as Unix socket paths are limited to ~100 characters
+        self.socket_path = Path(tempfile.gettempdir()) / f"dweam-fork-{str(uuid.uuid4())[:8]}.sock"
+        self.process: asyncio.subprocess.Process | None = None
+
+    @property
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self) -> None:
+        self.log.info("Starting fork server")
+        self.process = await asyncio.create_subprocess_exec(
+            str(self.venv_python),
+            str(self.script),
+            self.entrypoint.model_dump_json(),
+            self.game_id,
+            str(self.socket_path),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        asyncio.create_task(self._log_output(self.process.stderr, "stderr"))
+        try:
+            await asyncio.wait_for(self._wait_ready(), self.STARTUP_TIMEOUT)
+        except BaseException:
+            if self.process.returncode is None:
+                self.process.kill()
+            raise
+        asyncio.create_task(self._log_output(self.process.stdout, "stdout"))
+        self.log.info("Fork server ready", pid=self.process.pid)
+
+    async def _wait_ready(self) -> None:
+        assert self.process is not None and self.process.stdout is not None
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                raise RuntimeError(f"Fork server exited during startup with code {await self.process.wait()}")
+            output_line = line.decode("utf-8", errors="replace").rstrip()
+            if output_line == READY_LINE:
+                return
+            self.log.info("Fork server stdout", line=output_line)
+
+    async def _log_output(self, stream: asyncio.StreamReader | None, stream_name: str) -> None:
+        if stream is None:
+            return
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            self.log.info(f"Fork server {stream_name}", line=line.decode("utf-8", errors="replace").rstrip())
+
+    async def spawn(self, argv: list[str], control: socket.socket) -> ForkedProcess:
+        """
+        Fork a worker that runs `game_process.main(argv)`, with `control` as its end of the control channel.
+
+        The socket is passed to the template along with the request, which points the worker's
+        control argument at its own copy.
+        """
+        request = json.dumps({"argv": argv}).encode() + b"\n"
+        response = await asyncio.to_thread(self._request, request, control.fileno())
+        if not response:
+            raise RuntimeError("Fork server closed the connection")
+        return ForkedProcess(json.loads(response)["pid"])
+
+    def _request(self, request: bytes, fd: int) -> bytes:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(10.0)
+            sock.connect(str(self.socket_path))
+            sent = socket.send_fds(sock, [request], [fd])
+            sock.sendall(request[sent:])
+            return sock.makefile("rb").readline()
+
+    async def stop(self) -> None:
+        if self.process is not None and self.process.returncode is None:
+            self.process.terminate()
+            try:
+                await asyncio.wait_for(self.process.wait(), timeout=5.0)
+            except asyncio.TimeoutError:
+                self.process.kill()
+        self.socket_path.unlink(missing_ok=True)
+
+
+_fork_servers: dict[tuple[str, str], ForkServer] = {}
+_fork_server_locks: dict[tuple[str, str], asyncio.Lock] = {}
+
+
+async def get_fork_server(
+    log: BoundLogger,
+    venv_python: Path,
+    script: Path,
+    game_type: str,
+    game_id: str,
+    entrypoint: GameEntrypoint,
+) -> ForkServer:
+    """Get the running fork server for a game, starting it (or restarting it, if it died) as needed"""
+    key = (game_type, game_id)
+    lock = _fork_server_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        fork_server = _fork_servers.get(key)
+        if fork_server is None or not fork_server.is_alive:
+            if fork_server is not None:
+                log.warning("Fork server died; restarting", game_type=game_type, game_id=game_id)
+                await fork_server.stop()
+            fork_server = ForkServer(log, venv_python, script, game_id, entrypoint)
+            await fork_server.start()
+            _fork_servers[key] = fork_server
+        return fork_server
+
+
+async def stop_fork_servers() -> None:
+    await asyncio.gather(*[fork_server.stop() for fork_server in _fork_servers.values()], return_exceptions=True)
+    _fork_servers.clear()
+
+
+def _reseed() -> None:
+    """Give a forked worker its own random state, rather than a copy of the template's"""
+    import random
+    random.seed()
+    if "numpy" in sys.modules:
+        sys.modules["numpy"].random.seed()
+    if "torch" in sys.modules:
+        sys.modules["torch"].seed()
+
+
+def _run_worker(argv: list[str]) -> None:
+    """Run a worker in a freshly forked child; never returns"""
+    from dweam.game_process import main
+
+    code = 0
+    try:
+        _reseed()
+        asyncio.run(main(argv))
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def _receive_request(conn: socket.socket) -> tuple[list[str], int]:
+    """Read a spawn request, along with the worker's control socket sent with it"""
+    data = b""
+    fds: list[int] = []
+    while not data.endswith(b"\n"):
+        chunk, chunk_fds, _, _ = socket.recv_fds(conn, 65536, 1)
+        if not chunk:
+            break
+        data += chunk
+        fds += chunk_fds
+    if len(fds) != 1:
+        for fd in fds:
+            os.close(fd)
+        raise RuntimeError("Spawn request without a control socket")
+    return json.loads(data)["argv"], fds[0]
+
+
+def serve(argv: list[str]) -> None:
+    """Run the template process: preload the game, then fork a worker for each request on the socket"""
+    from dweam.log_config import get_logger
+    from dweam.utils.entrypoint import load_game_implementation
+
+    entrypoint = GameEntrypoint.model_validate_json(argv[1])
+    game_id = argv[2]
+    socket_path = argv[3]
+    log = get_logger().bind(process="fork-server", game_id=game_id)
+
+    # Everything imported and loaded here is shared with the workers
+    import dweam.game_process  # noqa: F401
+    import dweam.rtc  # noqa: F401
+    implementation = load_game_implementation(entrypoint.entrypoint, entrypoint.module_dir)
+    implementation.preload(game_id)
+    log.info("Preloaded game", entrypoint=entrypoint.entrypoint)
+
+    # Workers are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    parent_pid = os.getppid()
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    listener.listen()
+    listener.settimeout(1.0)
+    print(READY_LINE, flush=True)
+
+    try:
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except socket.timeout:
+                if os.getppid() != parent_pid:
+                    log.info("Server exited; stopping fork server")
+                    return
+                continue
+            with conn:
+                conn.settimeout(5.0)
+                try:
+                    argv, control_fd = _receive_request(conn)
+                except (OSError, ValueError, RuntimeError):
+                    log.exception("Invalid spawn request")
+                    continue
+                argv[CONTROL_ARG] = f"fd:{control_fd}"
+                pid = os.fork()
+                if pid == 0:
+                    listener.close()
+                    conn.close()
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    _run_worker(argv)
+                os.close(control_fd)
+                log.info("Forked worker", pid=pid)
+                conn.sendall(json.dumps({"pid": pid}).encode() + b"\n")
+    finally:
+        listener.close()
+        try:
+            os.unlink(socket_path)
+        except OSError:
+            pass
+
+
+if __name__ == "__main__":
+    serve(sys.argv)
@@ -1,18 +1,33 @@
-import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
 import threading
-from typing import ClassVar, Protocol
+import time
+from functools import partial
+from typing import Callable, ClassVar, Protocol
 from dataclasses import dataclass
 from typing import Optional
 from dweam.models import GameInfo
 from pydantic import BaseModel, Field
+import numpy as np
 import pygame
 from structlog import BoundLogger
+from dweam.constants import InputType
+from dweam.utils.frame import FrameBufferPool, FrameImage, YUV420Frame, tensor_to_ndarray
+from dweam.utils.input import InputEvent, InputRing
+from dweam.utils.mailbox import FrameMailbox, GameFrame
+from dweam.utils.metrics import LatencyHistogram
+from dweam.utils.pacing import FrameRateGovernor
 
 
 class Game:
     class Params(BaseModel):
         pass
 
+    # Copy each frame out on a hand-off thread while the next step() runs. Only enable this if
+    # step() returns a new frame object every call, rather than redrawing the same surface/buffer.
+    pipelined: ClassVar[bool] = False
+    # Rate the game loop idles at while paused, only processing input
+    paused_fps: ClassVar[float] = 10
+
     def __new__(cls, *args, **kwargs):
         # Validate that all parameters have defaults at class creation time
         missing_defaults = []
@@ -47,22 +62,79 @@ class Game:
 
         pygame.init()
         self.clock = pygame.time.Clock()
+        self.frame_rate = FrameRateGovernor()
 
         self.keys_pressed: set[int] = set()
         self.mouse_pressed: set[int] = set()
         self.mouse_motion: tuple[int, int] = (0, 0)
+        # Key and mouse button events for the game thread, written directly by the RTC layer
+        self.input_events = InputRing()
+        # Mouse motion received since the last step, coalesced into a single delta
+        self._motion_lock = threading.Lock()
+        self._pending_motion: tuple[float, float] = (0, 0)
+        self._pending_motion_event: InputEvent | None = None
+        # The oldest input consumed by the current step, stamped onto the frame it produces
+        self._step_input: InputEvent | None = None
 
         self.paused = False
         self.one_step_queued = False
 
+        # Set by step() to False when the frame it returns is identical to the previous one,
+        # or True when it's known to have changed. Left as None, frames are compared by checksum.
+        self.frame_changed: bool | None = None
+
         self._thread: threading.Thread | None = None
         self._stop_event = threading.Event()
-        self._frame_buffer: asyncio.Queue[pygame.Surface] = asyncio.Queue(maxsize=1)
+        # Set if the game loop stopped on an exception, after which the session should end
+        self.error: Exception | None = None
+        self._frame_mailbox = FrameMailbox()
+        # Counts of frames dropped after leaving the mailbox (e.g. queued for a slow encoder), registered by the stream
+        self._downstream_dropped: list[Callable[[], int]] = []
+
+        # Moving averages of how long each stage of the game loop takes, in seconds
+        self.stage_timings: dict[str, float] = {}
+        # Latency probe: how long each input waited between arriving and being applied by a step
+        self.input_wait = LatencyHistogram()
+        # Buffers that surfaces are copied into, reused once the stream is done with a frame
+        self._frame_buffers = FrameBufferPool()
+
+    @classmethod
+    def preload(cls, game_id: str) -> None:
+        """
+        Load resources that can be shared between sessions, such as model weights, e.g. into class attributes.
+
+        In fork-server mode this runs once in a template process that every session is forked from,
+        so the memory it allocates is shared copy-on-write. It must not start threads or initialize CUDA.
+        """
+        pass
 
-    def step(self) -> pygame.Surface:
+    def save_state(self) -> bytes:
+        """
+        Serialize the game's state, so that an idle session can be suspended and later resumed in a new worker.
+
+        Called once the game loop has stopped. Games that don't override this (and `load_state`) can't be suspended.
+        """
+        raise NotImplementedError
+
+    def load_state(self, state: bytes) -> None:
+        """
+        Restore state saved by `save_state`, before the game loop starts
+        """
+        raise NotImplementedError
+
+    @property
+    def can_suspend(self) -> bool:
+        """Whether the game implements `save_state` and `load_state`"""
+        return type(self).save_state is not Game.save_state and type(self).load_state is not Game.load_state
+
+    def step(self) -> FrameImage:
         """
         Render the next frame and handle game events, 
-        using `self.keys_pressed`, `self.mouse_pressed` and `self.mouse_motion`
+        using `self.keys_pressed`, `self.mouse_pressed` and `self.mouse_motion`.
+
+        The frame may be a pygame Surface, a (height, width, rgb) uint8 NumPy array or CPU tensor,
+        or a `YUV420Frame` for games that render in YUV. Arrays and tensors are streamed without
+        extra copies, so they shouldn't be modified after they're returned.
         """
         raise NotImplementedError
     
@@ -102,6 +174,23 @@ class Game:
         """
         self.params = new_params
 
+    def configure_frame_rate(
+        self,
+        fps: float | None = None,
+        min_fps: float | None = None,
+        max_fps: float | None = None,
+        adaptive: bool = True,
+    ) -> None:
+        """
+        Set the target frame rate, and the range the adaptive governor may move it within
+        """
+        self.frame_rate = FrameRateGovernor(
+            fps=fps if fps is not None else self.frame_rate.target_fps,
+            min_fps=min_fps,
+            max_fps=max_fps,
+            adaptive=adaptive,
+        )
+
     def start(self) -> None:
         """
         Start the game in a new thread
@@ -126,7 +215,128 @@ class Game:
             return
         self.log.warning("Game thread did not finish in 3s; thread is still running", 
                          thread_id=self._thread.ident)
-        self._thread = None
+
+    @property
+    def is_running(self) -> bool:
+        """Whether the game thread is (still) running"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def _process_input(self) -> tuple[set[int], set[int]]:
+        """
+        Apply queued input events to the pressed keys/buttons and mouse motion.
+
+        Returns the keys and mouse buttons that were pressed and released since the last step;
+        they're released only after the next step, so that the step still sees them pressed.
+        """
+        with self._motion_lock:
+            pending_x, pending_y = self._pending_motion
+            mouse_x, mouse_y = round(pending_x), round(pending_y)
+            # Keep sub-pixel remainders for the next step
+            self._pending_motion = (pending_x - mouse_x, pending_y - mouse_y)
+            motion_event, self._pending_motion_event = self._pending_motion_event, None
+
+        events = self.input_events.drain()
+        # Events are drained oldest first
+        oldest = events[0] if events else None
+        if motion_event is not None and (oldest is None or motion_event.received_at < oldest.received_at):
+            oldest = motion_event
+        if oldest is not None and self._step_input is None:
+            self._step_input = oldest
+
+        drained_at = time.monotonic()
+        if motion_event is not None:
+            self.input_wait.record(drained_at - motion_event.received_at)
+        for event in events:
+            self.input_wait.record(drained_at - event.received_at)
+
+        unprocessed_keys = set()
+        unprocessed_mouse = set()
+        keys_to_release = set()
+        mouse_to_release = set()
+
+        for event in events:
+            if event.type == InputType.MOUSEDOWN:
+                if event.code in self.mouse_pressed:
+                    continue
+                self.mouse_pressed.add(event.code)
+                self.on_mouse_down(event.code)
+                unprocessed_mouse.add(event.code)
+            elif event.type == InputType.MOUSEUP:
+                if event.code not in self.mouse_pressed:
+                    continue
+                if event.code in unprocessed_mouse:
+                    mouse_to_release.add(event.code)
+                else:
+                    self.mouse_pressed.remove(event.code)
+                    self.on_mouse_up(event.code)
+            elif event.type == InputType.KEYDOWN:
+                if event.code in self.keys_pressed:
+                    continue
+                self.keys_pressed.add(event.code)
+                self.on_key_down(event.code)
+                unprocessed_keys.add(event.code)
+            elif event.type == InputType.KEYUP:
+                if event.code not in self.keys_pressed:
+                    continue
+                if event.code in unprocessed_keys:
+                    keys_to_release.add(event.code)
+                else:
+                    self.keys_pressed.remove(event.code)
+                    self.on_key_up(event.code)
+        
+        self.mouse_motion = (mouse_x, mouse_y)
+        if self.mouse_motion != (0, 0):
+            self.on_mouse_motion(self.mouse_motion)
+
+        return keys_to_release, mouse_to_release
+
+    def _release_pending(self, keys_to_release: set[int], mouse_to_release: set[int]) -> None:
+        """Release keys and mouse buttons that were pressed and released before the last step"""
+        for key in keys_to_release:
+            self.keys_pressed.remove(key)
+            self.on_key_up(key)
+        for button in mouse_to_release:
+            self.mouse_pressed.remove(button)
+            self.on_mouse_up(button)
+
+    def _hand_off(
+        self,
+        frame: FrameImage,
+        changed: bool | None,
+        input: InputEvent | None,
+        step_started_at: float,
+    ) -> None:
+        """Copy a frame out of the game and publish it (runs on the hand-off thread in pipelined mode)"""
+        start = time.perf_counter()
+        frame, on_release = self._copy_frame(frame)
+        if not isinstance(frame, (np.ndarray, YUV420Frame)):
+            frame = tensor_to_ndarray(frame)
+        self._frame_mailbox.put(frame, changed, input, step_started_at, on_release)
+        self._record_stage("handoff", time.perf_counter() - start)
+
+    def _copy_frame(self, frame: FrameImage) -> tuple[FrameImage, Callable[[], None] | None]:
+        """
+        Copy a surface the game keeps drawing to into a pooled buffer, along with the callback that returns
+        the buffer to the pool once the frame is released. Other frames are passed through.
+        """
+        if not isinstance(frame, pygame.Surface):
+            return frame, None
+        buffer = self._frame_buffers.copy_surface(frame)
+        return buffer, partial(self._frame_buffers.release, buffer)
+
+    def _record_stage(self, stage: str, duration: float) -> None:
+        """Update the moving average duration of a stage of the game loop"""
+        average = self.stage_timings.get(stage)
+        if average is None:
+            self.stage_timings[stage] = duration
+        else:
+            self.stage_timings[stage] = average + (duration - average) / 16
+
+    def _tick(self) -> None:
+        """Sleep for the rest of the frame interval"""
+        start = time.perf_counter()
+        self.clock.tick(self.paused_fps if self.paused else self.frame_rate.fps)
+        self._record_stage("sleep", time.perf_counter() - start)
 
     def run(self) -> None:
         """
@@ -134,81 +344,131 @@ class Game:
         """
         # pygame.init()
 
-        while not self._stop_event.is_set():
-            mouse_x, mouse_y = 0, 0
-            pygame.event.pump()
-
-            unprocessed_keys = set()
-            unprocessed_mouse = set()
-            keys_to_release = set()
-            mouse_to_release = set()
-
-            for event in pygame.event.get():
-                if event.type == pygame.MOUSEMOTION:
-                    mouse_x += event.rel[0]
-                    mouse_y += event.rel[1]
-
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    if event.button in self.mouse_pressed:
-                        continue
-                    self.mouse_pressed.add(event.button)
-                    self.on_mouse_down(event.button)
-                    unprocessed_mouse.add(event.button)
-                elif event.type == pygame.MOUSEBUTTONUP:
-                    if event.button not in self.mouse_pressed:
-                        continue
-                    if event.button in unprocessed_mouse:
-                        mouse_to_release.add(event.button)
-                    else:
-                        self.mouse_pressed.remove(event.button)
-                        self.on_mouse_up(event.button)
-                elif event.type == pygame.KEYDOWN:
-                    if event.key in self.keys_pressed:
-                        continue
-                    self.keys_pressed.add(event.key)
-                    self.on_key_down(event.key)
-                    unprocessed_keys.add(event.key)
-                elif event.type == pygame.KEYUP:
-                    if event.key not in self.keys_pressed:
-                        continue
-                    if event.key in unprocessed_keys:
-                        keys_to_release.add(event.key)
+        handoff_executor = None
+        if self.pipelined:
+            handoff_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="frame-handoff")
+        handoff: Future | None = None
+
+        try:
+            while not self._stop_event.is_set():
+                if self.pipelined:
+                    # Sleep first, so input is sampled right before the step
+                    self._tick()
+
+                start = time.perf_counter()
+                keys_to_release, mouse_to_release = self._process_input()
+                self._record_stage("input", time.perf_counter() - start)
+
+                if not self.paused and not self.one_step_queued:
+                    # self.log.debug("Initiating game step")
+                    step_started_at = time.monotonic()
+                    step_start = time.perf_counter()
+                    frame = self.step()
+                    step_duration = time.perf_counter() - step_start
+                    changed, self.frame_changed = self.frame_changed, None
+                    step_input, self._step_input = self._step_input, None
+                    self._record_stage("step", step_duration)
+                    self.frame_rate.record_step(step_duration, self.backpressure_drops)
+                    
+                    # Now process any pending releases
+                    self._release_pending(keys_to_release, mouse_to_release)
+                    
+                    if handoff_executor is None:
+                        # The game keeps drawing to its surface, so the stream gets a copy of it
+                        frame, on_release = self._copy_frame(frame)
+                        # Hand the new frame over, replacing any frame the encoder hasn't picked up yet
+                        self._frame_mailbox.put(frame, changed, step_input, step_started_at, on_release)
                     else:
-                        self.keys_pressed.remove(event.key)
-                        self.on_key_up(event.key)
-            
-            self.mouse_motion = (mouse_x, mouse_y)
-            if self.mouse_motion != (0, 0):
-                self.on_mouse_motion(self.mouse_motion)
-
-            if not self.paused and not self.one_step_queued:
-                # self.log.debug("Initiating game step")
-                surface = self.step()
-                
-                # Now process any pending releases
-                for key in keys_to_release:
-                    self.keys_pressed.remove(key)
-                    self.on_key_up(key)
-                for button in mouse_to_release:
-                    self.mouse_pressed.remove(button)
-                    self.on_mouse_up(button)
-                
-                # Put new frame in buffer
-                while not self._frame_buffer.empty():
-                    self._frame_buffer.get_nowait()
-                self._frame_buffer.put_nowait(surface)
-                
-            self.one_step_queued = False
-
-            self.clock.tick(30)  # TODO unhardcode FPS
+                        # Copy frame N out while step N+1 runs; at most one hand-off is in flight
+                        if handoff is not None:
+                            handoff.result()
+                        handoff = handoff_executor.submit(
+                            self._hand_off, frame, changed, step_input, step_started_at
+                        )
+                    
+                self.one_step_queued = False
+
+                if not self.pipelined:
+                    self._tick()
+        except Exception as e:
+            self.error = e
+            self.log.exception("Game loop failed")
+        finally:
+            if handoff_executor is not None:
+                handoff_executor.shutdown(wait=False, cancel_futures=True)
 
         # pygame.quit()
 
+    def post_input(
+        self,
+        event_type: InputType,
+        code: int,
+        client_ts: float | None = None,
+        seq: int | None = None,
+    ) -> None:
+        """
+        Queue a key or mouse button event (`code` being a pygame key or button) for the next step.
+        Must only be called from a single thread, usually the RTC layer's event loop.
+        """
+        if not self.input_events.push(event_type, code, client_ts, seq):
+            self.log.warning("Input buffer full, dropping event", type=event_type, code=code)
+
+    def add_mouse_motion(
+        self,
+        dx: float,
+        dy: float,
+        client_ts: float | None = None,
+        seq: int | None = None,
+    ) -> None:
+        """
+        Add relative mouse motion, to be reported as part of the next step's `mouse_motion`.
+        Safe to call from any thread.
+        """
+        with self._motion_lock:
+            x, y = self._pending_motion
+            self._pending_motion = (x + dx, y + dy)
+            if self._pending_motion_event is None:
+                # Latency is measured from the first motion coalesced into the step
+                self._pending_motion_event = InputEvent(
+                    InputType.MOUSEMOVE, 0, client_ts, time.monotonic(), seq
+                )
+
     def do_one_step(self) -> None:
         """
         When paused, perform a single step once
         """
         self.one_step_queued = True
 
-    async def get_next_frame(self) -> pygame.Surface:
-        return await self._frame_buffer.get()
+    async def get_next_frame(self) -> GameFrame:
+        """
+        Wait for the latest frame produced by the game thread
+        """
+        return await self._frame_mailbox.take()
+
+    async def wait_first_frame(self) -> float:
+        """
+        Wait until the game thread has produced its first frame, returning when it did (`time.time()`)
+        """
+        return await self._frame_mailbox.first_frame()
+
+    @property
+    def frames_dropped(self) -> int:
+        """Number of frames overwritten before the encoder picked them up"""
+        return self._frame_mailbox.dropped
+
+    @property
+    def backpressure_drops(self) -> int:
+        """Number of frames dropped anywhere between the game and the encoder, which the frame rate adapts to"""
+        return self.frames_dropped + sum(source() for source in tuple(self._downstream_dropped))
+
+    def add_dropped_frames_source(self, source: Callable[[], int]) -> None:
+        """Count the frames dropped by a later stage of the stream (e.g. the encoder's queue) as backpressure"""
+        self._downstream_dropped.append(source)
+
+    def remove_dropped_frames_source(self, source: Callable[[], int]) -> None:
+        if source in self._downstream_dropped:
+            self._downstream_dropped.remove(source)
+
+    def stage_stats(self) -> dict[str, float]:
+        """Get the average duration of each stage of the game loop, in milliseconds"""
+        return {stage: duration * 1000 for stage, duration in self.stage_timings.items()}
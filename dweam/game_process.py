@@ -3,140 +3,52 @@ logging.getLogger("aioice.ice").disabled = True
 
 import asyncio
 import json
+import os
+import socket
 import sys
-from typing import Any
-from datetime import datetime, timedelta
-from dweam.constants import JS_TO_PYGAME_BUTTON_MAP, JS_TO_PYGAME_KEY_MAP
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
 from dweam.log_config import get_logger
 from pydantic import TypeAdapter
-import pygame
-import numpy as np
-from av.video.frame import VideoFrame
-from aiortc import VideoStreamTrack, RTCPeerConnection, RTCSessionDescription, RTCConfiguration, RTCIceServer, RTCDataChannel
-from aiortc.contrib.signaling import object_from_string, object_to_string
-import torch
-import os
-import socket
 from dweam.utils.process import patch_subprocess_popen
+from dweam.utils.metrics import LoopLagMonitor
+from dweam.utils.memory import process_memory
+from dweam.utils.cpu import apply_cpu_budget
 
-from dweam.utils.entrypoint import load_games, get_cache_dir
+from dweam.utils.entrypoint import load_games, load_game_implementation
 from dweam.commands import (
-    Command, Response, SchemaCommand, StopCommand, 
-    UpdateParamsCommand, HandleOfferCommand,
-    SuccessResponse, ErrorResponse
+    GameEntrypoint, Command, Response, SchemaCommand, StopCommand, 
+    UpdateParamsCommand, HandleOfferCommand, StatsCommand, SetQualityCommand, PrepareCommand, PingCommand, SuspendCommand, CpuBudgetCommand,
+    SuccessResponse, ErrorResponse, PhaseEvent, ExitEvent, StartupPhase
 )
 
+# The streaming stack (aiortc, av, numpy, pygame) is imported in main() once connected to the parent,
+# so that connecting back doesn't wait on it
+if TYPE_CHECKING:
+    from dweam.rtc import GameRTCConnection
 
-class GameVideoTrack(VideoStreamTrack):
-    """A video stream track that captures frames from a Pygame application."""
-    def __init__(self, game: Any):
-        super().__init__()
-        self.game = game
-
-    async def recv(self) -> VideoFrame:
-        await asyncio.sleep(1 / 30)  # 30 FPS
-        surface = await self.game.get_next_frame()
-        frame = pygame.surfarray.array3d(surface)
-        frame = np.fliplr(frame)
-        frame = np.rot90(frame)
-        new_frame = VideoFrame.from_ndarray(frame, format='rgb24')
-        new_frame.pts, new_frame.time_base = await self.next_timestamp()
-        return new_frame
-
-class GameRTCConnection:
-    def __init__(self, game: Any, ice_servers: list[dict] | None = None):
-        self.game = game
-        self.last_heartbeat = datetime.now()
-        self.cleanup_scheduled = False
-        
-        # Configure ICE servers
-        config = RTCConfiguration(
-            iceServers=[RTCIceServer(**server) for server in (ice_servers or [])]
-        )
-        self.pc = RTCPeerConnection(configuration=config)
-        self.data_channel: RTCDataChannel | None = None
-        
-        # Add video track
-        self.pc.addTrack(GameVideoTrack(self.game))
-        
-        @self.pc.on("datachannel")
-        def on_datachannel(channel: RTCDataChannel):
-            self.data_channel = channel
-            
-            @channel.on("message")
-            def on_message(message):
-                if not isinstance(message, str):
-                    return
-                    
-                try:
-                    data = json.loads(message)
-                    if data["type"] == "heartbeat":
-                        self.last_heartbeat = datetime.now()
-                    else:
-                        self.handle_game_input(data)
-                except Exception as e:
-                    print(f"Error handling message: {e}", file=sys.stderr)
-                    
-        @self.pc.on("connectionstatechange")
-        async def on_connectionstatechange():
-            # print(f"Connection state changed to: {self.pc.connectionState}", file=sys.stderr)
-            if self.pc.connectionState in ("failed", "closed", "disconnected"):
-                await self.cleanup()
-
-    @property
-    def is_stale(self) -> bool:
-        """Check if the connection hasn't received a heartbeat recently"""
-        return datetime.now() - self.last_heartbeat > timedelta(seconds=5)
-
-    def handle_game_input(self, data: dict):
-        """Handle game input events"""
-        try:
-            if data["type"] == "keydown":
-                pygame_key = JS_TO_PYGAME_KEY_MAP.get(data["key"])
-                if pygame_key is not None:
-                    pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=pygame_key))
-            elif data["type"] == "keyup":
-                pygame_key = JS_TO_PYGAME_KEY_MAP.get(data["key"])
-                if pygame_key is not None:
-                    pygame.event.post(pygame.event.Event(pygame.KEYUP, key=pygame_key))
-            elif data["type"] == "mousemove":
-                movement = (data["movementX"], data["movementY"])
-                pygame.event.post(pygame.event.Event(pygame.MOUSEMOTION, rel=movement))
-            elif data["type"] == "mousedown":
-                pygame_button = JS_TO_PYGAME_BUTTON_MAP.get(data["button"])
-                if pygame_button is not None:
-                    pygame.event.post(pygame.event.Event(pygame.MOUSEBUTTONDOWN, button=pygame_button))
-            elif data["type"] == "mouseup":
-                pygame_button = JS_TO_PYGAME_BUTTON_MAP.get(data["button"])
-                if pygame_button is not None:
-                    pygame.event.post(pygame.event.Event(pygame.MOUSEBUTTONUP, button=pygame_button))
-        except Exception as e:
-            print(f"Error handling input: {e}", file=sys.stderr)
 
-    async def handle_offer(self, sdp: str, type_: str):
-        """Handle incoming WebRTC offer"""
-        offer = RTCSessionDescription(sdp=sdp, type=type_)
-        await self.pc.setRemoteDescription(offer)
-        
-        answer = await self.pc.createAnswer()
-        await self.pc.setLocalDescription(answer)
-        
-        return {
-            "sdp": self.pc.localDescription.sdp,
-            "type": self.pc.localDescription.type
-        }
-
-    async def cleanup(self):
-        """Cleanup resources"""
-        if self.cleanup_scheduled:
-            return
-            
-        self.cleanup_scheduled = True
-        if self.pc.connectionState != "closed":
-            await self.pc.close()
-        # Game cleanup will be handled by the main process
+@dataclass
+class Session:
+    """A game and its stream, hosted by a worker"""
+    game: Any = None
+    game_started: bool = False
+    rtc: "GameRTCConnection | None" = None
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    first_frame_task: asyncio.Task | None = None
+    # Set while the session's state is being saved, when its client is expected to go away
+    suspending: bool = False
 
-async def main():
+
+async def main(argv: list[str] | None = None):
+    """Run a worker; `argv` defaults to the command line, and is passed directly by the fork server"""
+    started_at = time.time()
+    if argv is None:
+        argv = sys.argv
+    # The interpreter has already read it, so this only keeps the game's own subprocesses from profiling imports
+    os.environ.pop("PYTHONPROFILEIMPORTTIME", None)
     # Patch subprocess to hide windows in release mode
     patch_subprocess_popen()
     
@@ -144,78 +56,322 @@ async def main():
     log.info("Starting worker process")
 
     # Log all command line arguments
-    log.info("Command line args", argv=sys.argv)
+    log.info("Command line args", argv=argv)
     
     # Get game type, ID and optional ICE servers from command line args
 
     try:
-        game_type = json.loads(sys.argv[1])
+        game_type = json.loads(argv[1])
     except json.JSONDecodeError:
         # Windows seems to decode the json implicitly
-        game_type = sys.argv[1]
+        game_type = argv[1]
 
-    game_id = sys.argv[2]
-    ice_servers = json.loads(sys.argv[3]) if len(sys.argv) > 3 else None
-    port = int(sys.argv[4])
+    game_id = argv[2]
+    ice_servers = json.loads(argv[3]) if len(argv) > 3 else None
+    # Either `fd:<n>`, a socket inherited from the parent, or the port of the parent's TCP server
+    control = argv[4]
     
-    log.info("Parsed args", game_type=game_type, game_id=game_id, port=port)
+    log.info("Parsed args", game_type=game_type, game_id=game_id, control=control)
     
     try:
         # Connect to parent process
-        reader, writer = await asyncio.open_connection(
-            '127.0.0.1',
-            port
-        )
+        if control.startswith("fd:"):
+            reader, writer = await asyncio.open_connection(sock=socket.socket(fileno=int(control[3:])))
+        else:
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1',
+                int(control)
+            )
         log.info("Connected to parent")
     except Exception as e:
         log.error("Failed to connect to parent", error=str(e))
         raise
 
+    async def send_phase(
+        phase: StartupPhase,
+        session_id: str | None = None,
+        duration: float | None = None,
+        timestamp: float | None = None,
+    ):
+        """Tell the server a startup phase has completed"""
+        event = PhaseEvent(
+            phase=phase,
+            session_id=session_id,
+            timestamp=timestamp if timestamp is not None else time.time(),
+            duration=duration,
+        )
+        writer.write(event.model_dump_json().encode() + b"\n")
+        await writer.drain()
+
+    exit_sent = False
+    # Set when the worker stops on an error, in which case it exits without an exit event
+    failed = False
+
+    async def send_exit(reason: str):
+        """Tell the server the worker is exiting on purpose, rather than crashing"""
+        nonlocal exit_sent
+        if exit_sent or writer.is_closing():
+            return
+        exit_sent = True
+        try:
+            writer.write(ExitEvent(reason=reason).model_dump_json().encode() + b"\n")
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def close_writer():
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            # The server closed its end first
+            pass
+
+    await send_phase("spawned", timestamp=started_at)
+
+    import_start = time.perf_counter()
+    from dweam.rtc import GameRTCConnection
+    log.info("Imported streaming stack", duration_ms=(time.perf_counter() - import_start) * 1000)
+
     # Load the game implementation
-    games = load_games(log)
-    log.info("Loaded games")
-    log.info("Looking up game", game_type=game_type, game_id=game_id)
-    
-    # Check if game_type exists
-    if game_type not in games:
-        log.error("Game type not found", available_types=list(games.keys()))
-        raise KeyError(f"Game type '{game_type}' not found")
+    load_start = time.perf_counter()
+    if len(argv) > 5:
+        # The server already resolved the game's entrypoint, so only its module needs importing
+        entrypoint = GameEntrypoint.model_validate_json(argv[5])
+        game_info = entrypoint.game_info
+        implementation = load_game_implementation(entrypoint.entrypoint, entrypoint.module_dir)
+    else:
+        games = load_games(log)
+        log.info("Loaded games")
+        log.info("Looking up game", game_type=game_type, game_id=game_id)
         
-    # Check if game_id exists
-    if game_id not in games[game_type]:
-        log.error("Game ID not found", 
-                 available_ids=list(games[game_type].keys()),
-                 game_type=game_type)
-        raise KeyError(f"Game ID '{game_id}' not found in {game_type}")
-    
-    game_info = games[game_type][game_id]
-    implementation = game_info.get_implementation()
+        # Check if game_type exists
+        if game_type not in games:
+            log.error("Game type not found", available_types=list(games.keys()))
+            raise KeyError(f"Game type '{game_type}' not found")
+            
+        # Check if game_id exists
+        if game_id not in games[game_type]:
+            log.error("Game ID not found", 
+                     available_ids=list(games[game_type].keys()),
+                     game_type=game_type)
+            raise KeyError(f"Game ID '{game_id}' not found in {game_type}")
+        
+        game_info = games[game_type][game_id]
+        implementation = game_info.get_implementation()
+    log.info(
+        "Loaded game implementation",
+        resolved=len(argv) > 5,
+        duration_ms=(time.perf_counter() - load_start) * 1000,
+    )
+    await send_phase("imports_done", duration=time.perf_counter() - import_start)
     
-    game = None
-    rtc = None
+    # The compute threads and CPUs the server last assigned this process
+    cpu_budget: dict[str, Any] = {"threads": None, "cpus": None}
+
+    # Sessions hosted by this worker, keyed by session id; a single-session worker uses None
+    sessions: dict[str | None, Session] = {}
     should_exit = False
 
+    def create_game():
+        """Construct the game (loading any models) and configure its frame rate"""
+        game = implementation(
+            log=log,
+            game_id=game_id,
+        )
+        game.configure_frame_rate(
+            fps=game_info.fps,
+            min_fps=game_info.min_fps,
+            max_fps=game_info.max_fps,
+            adaptive=game_info.adaptive_fps,
+        )
+        return game
+
+    async def load_game(session_id: str | None):
+        """Create a session's game off the event loop, so streams of other sessions keep running while models load"""
+        load_start = time.perf_counter()
+        game = await asyncio.to_thread(create_game)
+        await send_phase("model_loaded", session_id, duration=time.perf_counter() - load_start)
+        return game
+
+    def write_snapshot(path: Path, state: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Written aside and renamed, so a resume never reads half a snapshot
+        partial = path.with_name(path.name + ".partial")
+        partial.write_bytes(state)
+        partial.replace(path)
+
+    async def report_first_frame(session_id: str | None, game, game_started_at: float):
+        first_frame_at = await game.wait_first_frame()
+        await send_phase("first_frame", session_id, duration=first_frame_at - game_started_at, timestamp=first_frame_at)
+
+    async def close_session(session_id: str | None):
+        """Stop a session's stream and game"""
+        session = sessions.pop(session_id, None)
+        if session is None:
+            return
+        if session.first_frame_task:
+            session.first_frame_task.cancel()
+        if session.rtc:
+            await session.rtc.cleanup()
+        if session.game:
+            session.game.stop()
+
     async def check_connection():
-        """Check connection state and cleanup if stale"""
-        nonlocal should_exit
+        """End sessions whose connection went stale or closed, or whose game loop failed"""
+        nonlocal should_exit, failed
         while not should_exit:
             await asyncio.sleep(1)  # Check every second
-            if rtc and (rtc.is_stale or rtc.pc.connectionState in ("failed", "closed", "disconnected")):
-                log.info("Connection stale or closed, cleaning up")
-                await rtc.cleanup()
-                if game:
-                    game.stop()
-                    
-                writer.close()
-                await writer.wait_closed()
+            for session_id, session in list(sessions.items()):
+                rtc = session.rtc
+                if session.suspending:
+                    continue
+                game_failed = session.game is not None and session.game.error is not None
+                if game_failed:
+                    log.error("Game loop failed, ending session", session_id=session_id, error=str(session.game.error))
+                elif rtc and (rtc.is_stale or rtc.pc.connectionState in ("failed", "closed", "disconnected")):
+                    log.info("Connection stale or closed, cleaning up", session_id=session_id)
+                else:
+                    continue
+                await close_session(session_id)
+                if session_id is not None:
+                    # Other sessions may still be running; the server stops the worker once they're done
+                    continue
+
+                if game_failed:
+                    # Exit without saying why, so the server counts it as a crash
+                    failed = True
+                else:
+                    await send_exit("connection closed")
+                await close_writer()
                 log.info("Connection checker requesting process exit")
                 should_exit = True
                 return
     
     # Start connection checker
     checker_task = asyncio.create_task(check_connection())
-    
-    # Process commands
+
+    # Track how responsive the event loop stays while streaming
+    loop_lag = LoopLagMonitor()
+    loop_lag.start()
+
+    async def handle_command(command: Command) -> Response:
+        """Run a command for its session, returning the response"""
+        nonlocal should_exit
+        if isinstance(command, StopCommand):
+            if command.session_id is None:
+                for session_id in list(sessions):
+                    await close_session(session_id)
+                should_exit = True
+                # Ahead of the response, since the server may close the channel once it has that
+                await send_exit("stopped")
+            else:
+                await close_session(command.session_id)
+            return SuccessResponse()
+
+        if isinstance(command, PingCommand):
+            return SuccessResponse(data={"sessions": list(sessions)})
+
+        if isinstance(command, CpuBudgetCommand):
+            apply_cpu_budget(command.threads, command.cpus)
+            cpu_budget.update(threads=command.threads, cpus=command.cpus)
+            log.info("Applied CPU budget", threads=command.threads, cpus=command.cpus)
+            return SuccessResponse()
+
+        if isinstance(command, SchemaCommand):
+            schema = implementation.Params.model_json_schema()
+            return SuccessResponse(data=schema)
+
+        if isinstance(command, (PrepareCommand, HandleOfferCommand)):
+            session = sessions.setdefault(command.session_id, Session())
+        else:
+            session = sessions.get(command.session_id) or Session()
+
+        # Commands for the same session run in order; other sessions aren't held up
+        async with session.lock:
+            if isinstance(command, UpdateParamsCommand):
+                params = implementation.Params.model_validate(command.data)
+                session.game.on_params_update(params)
+                return SuccessResponse()
+                
+            elif isinstance(command, PrepareCommand):
+                if session.game is None:
+                    session.game = await load_game(command.session_id)
+                return SuccessResponse()
+
+            elif isinstance(command, HandleOfferCommand):
+                offer_start = time.perf_counter()
+                if session.game is None:
+                    session.game = await load_game(command.session_id)
+                if command.snapshot is not None and not session.game_started:
+                    state = await asyncio.to_thread(command.snapshot.read_bytes)
+                    await asyncio.to_thread(session.game.load_state, state)
+                    log.info("Restored game state", bytes=len(state), session_id=command.session_id)
+                if not session.game_started:
+                    session.first_frame_task = asyncio.create_task(
+                        report_first_frame(command.session_id, session.game, time.time())
+                    )
+                    session.game.start()
+                    session.game_started = True
+                session.rtc = GameRTCConnection(session.game, ice_servers)
+                answer = await session.rtc.handle_offer(command.data.sdp, command.data.type)
+                await send_phase("answer_ready", command.session_id, duration=time.perf_counter() - offer_start)
+                return SuccessResponse(data=answer)
+                
+            elif isinstance(command, SuspendCommand):
+                if session.game is None or not session.game.can_suspend:
+                    raise RuntimeError("Game doesn't support suspending")
+                session.suspending = True
+                try:
+                    # The game loop has to stop first, so the state doesn't change while it's saved
+                    await asyncio.to_thread(session.game.stop)
+                    if session.game.is_running:
+                        raise RuntimeError("Game loop didn't stop; not saving its state")
+                    state = await asyncio.to_thread(session.game.save_state)
+                    await asyncio.to_thread(write_snapshot, command.path, state)
+                except BaseException:
+                    session.suspending = False
+                    if not session.game.is_running:
+                        # Carry on playing
+                        session.game.start()
+                    raise
+                if session.rtc:
+                    await session.rtc.notify_suspended()
+                await close_session(command.session_id)
+                return SuccessResponse(data={"bytes": len(state)})
+
+            elif isinstance(command, SetQualityCommand):
+                if session.rtc is None:
+                    raise RuntimeError("No active video stream")
+                session.rtc.video_track.scaler.set_tier(command.tier)
+                return SuccessResponse()
+
+            elif isinstance(command, StatsCommand):
+                return SuccessResponse(data={
+                    "event_loop": loop_lag.stats(),
+                    "memory": process_memory(),
+                    "cpu_budget": cpu_budget,
+                    "sessions": len(sessions),
+                    "can_suspend": session.game is not None and session.game.can_suspend,
+                    **(session.rtc.get_stats() if session.rtc else {}),
+                })
+
+        raise ValueError(f"Unknown command: {command.cmd}")
+
+    async def process_command(command: Command):
+        response: Response
+        try:
+            response = await handle_command(command)
+        except Exception as e:
+            log.exception("Error processing command", command_type=type(command))
+            response = ErrorResponse(error=str(e))
+        response.request_id = command.request_id
+        response.session_id = command.session_id
+        writer.write(response.model_dump_json().encode() + b"\n")
+        await writer.drain()
+
+    # Process commands, each in its own task so that a slow command doesn't block other sessions
+    command_tasks: set[asyncio.Task] = set()
     while not should_exit:
         try:
             line = await reader.readline()
@@ -224,53 +380,27 @@ async def main():
                 break
                 
             command = TypeAdapter(Command).validate_json(line)
-            response: Response
-            
-            try:
-                if isinstance(command, SchemaCommand):
-                    schema = implementation.Params.model_json_schema()
-                    response = SuccessResponse(data=schema)
-                    
-                elif isinstance(command, UpdateParamsCommand):
-                    params = implementation.Params.model_validate(command.data)
-                    game.on_params_update(params)
-                    response = SuccessResponse()
-                    
-                elif isinstance(command, HandleOfferCommand):
-                    if game is None:
-                        game = implementation(
-                            log=log,
-                            game_id=game_id,
-                        )
-                        game.start()
-                    rtc = GameRTCConnection(game, ice_servers)
-                    answer = await rtc.handle_offer(command.data.sdp, command.data.type)
-                    response = SuccessResponse(data=answer)
-                    
-                elif isinstance(command, StopCommand):
-                    if rtc:
-                        await rtc.cleanup()
-                    response = SuccessResponse()
-                    should_exit = True
-                
-            except Exception as e:
-                log.exception("Error processing command", command_type=type(command))
-                response = ErrorResponse(error=str(e))
-                
-            writer.write(response.model_dump_json().encode() + b"\n")
-            await writer.drain()
+            if isinstance(command, StopCommand) and command.session_id is None:
+                await process_command(command)
+                continue
+            task = asyncio.create_task(process_command(command))
+            command_tasks.add(task)
+            task.add_done_callback(command_tasks.discard)
             
         except Exception as e:
             print(f"Error processing command: {e}", file=sys.stderr)
+            failed = True
             should_exit = True
 
     # Clean up
-    if rtc:
-        await rtc.cleanup()
-    if game:
-        game.stop()
-    writer.close()
-    await writer.wait_closed()
+    for task in command_tasks:
+        task.cancel()
+    for session_id in list(sessions):
+        await close_session(session_id)
+    await loop_lag.stop()
+    if not failed:
+        await send_exit("stopped")
+    await close_writer()
     checker_task.cancel()
     try:
         await checker_task
@@ -64,6 +64,11 @@ class GameInfo(StrictModel):
     description: str | None = Field(default=None, description="Short description for the game")
     tags: list[str] | None = Field(default=None, description="List of tags for the game")
     buttons: dict[str, str] | None = Field(default=None, description="Mapping of button labels to key combinations")
+    fps: float | None = Field(default=None, description="Target frame rate (defaults to 30)")
+    min_fps: float | None = Field(default=None, description="Lowest frame rate the adaptive governor may drop to")
+    max_fps: float | None = Field(default=None, description="Highest frame rate the adaptive governor may raise to (defaults to fps)")
+    adaptive_fps: bool = Field(default=True, description="Adapt the frame rate to measured step duration and encoder backpressure")
+    sessions_per_worker: int = Field(default=1, ge=1, description="Number of sessions a worker process may host, for lightweight games")
     _metadata: "PackageMetadata | None" = PrivateAttr(None)
 
     def get_implementation(self) -> type:
@@ -0,0 +1,348 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any
+
+from aiortc import VideoStreamTrack, RTCPeerConnection, RTCSessionDescription, RTCConfiguration, RTCIceServer, RTCDataChannel
+from av.video.frame import VideoFrame
+import pygame
+
+from dweam.constants import (
+    JS_TO_PYGAME_BUTTON_MAP, JS_TO_PYGAME_KEY_MAP, JSON_INPUT_TYPES,
+    INPUT_PROTOCOL_BINARY, INPUT_PROTOCOL_JSON, INPUT_STRUCT, InputType,
+)
+from dweam.utils.frame import FrameConverter, FrameScaler, frame_digest
+from dweam.utils.pacing import FramePacer
+from dweam.utils.mailbox import GameFrame
+from dweam.utils.metrics import ClockOffsetEstimator, LatencyTracker
+
+
+class GameVideoTrack(VideoStreamTrack):
+    """A video stream track that captures frames from a Pygame application."""
+
+    # Number of converted frames that may wait for the encoder before the oldest is dropped
+    MAX_PREPARED_FRAMES = 2
+    # While frames are unchanged or the game is paused, the last frame is resent at this interval
+    KEEPALIVE_INTERVAL = 1.0
+    # Stages of input-to-photon latency, measured for each frame that shows the effect of an input
+    LATENCY_STAGES = ("network_in", "queueing", "step", "convert", "encode", "send", "total")
+
+    def __init__(self, game: Any):
+        super().__init__()
+        self.game = game
+        # yuv420p is converted here, so the encoder doesn't have to; set to rgb24 to leave it to the encoder
+        self.converter = FrameConverter(pixel_format=os.environ.get("VIDEO_PIXEL_FORMAT", "yuv420p"))
+        self.pacer = FramePacer(fps=30)
+        self.scaler = FrameScaler()
+        self._returned_at: float | None = None
+
+        # Frame conversion runs on its own thread, so the event loop is left free for networking
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="frame-prep")
+        self._prepared: asyncio.Queue[tuple[GameFrame, VideoFrame]] = asyncio.Queue(maxsize=self.MAX_PREPARED_FRAMES)
+        self._prepare_task: asyncio.Task | None = None
+        self.prepared_dropped = 0
+        # Frames dropped here mean the encoder can't keep up, so the game's frame rate should come down
+        game.add_dropped_frames_source(self._count_prepared_dropped)
+
+        self._last_digest: tuple[int, float] | None = None
+        self._last_frame: VideoFrame | None = None
+        self.frames_unchanged = 0
+        self.keepalives_sent = 0
+
+        self.latency = LatencyTracker(self.LATENCY_STAGES)
+        # Maps client timestamps to the local clock; fed by the RTC connection's pings
+        self.clock = ClockOffsetEstimator()
+        self._encoding: GameFrame | None = None
+
+    def _count_prepared_dropped(self) -> int:
+        return self.prepared_dropped
+
+    def _prepare(self, game_frame: GameFrame, scale: float) -> VideoFrame | None:
+        """
+        Convert a frame on the frame-prep thread, or return None if it's identical to the last one.
+
+        Frames arrive as arrays the game thread has copied out, never a surface it may still be drawing to.
+        """
+        if isinstance(game_frame.image, pygame.Surface):
+            raise TypeError("Surfaces must be copied on the game thread before they're handed to the stream")
+        if game_frame.changed is False:
+            return None
+        if game_frame.changed is None:
+            digest = (frame_digest(game_frame.image), scale)
+            if digest == self._last_digest:
+                return None
+            self._last_digest = digest
+        else:
+            self._last_digest = None
+        return self.converter.to_video_frame(game_frame.image, scale)
+
+    async def _prepare_frames(self) -> None:
+        """Convert frames from the game as they're produced, and queue them for the encoder"""
+        loop = asyncio.get_running_loop()
+        while True:
+            game_frame = await self.game.get_next_frame()
+            video_frame = await loop.run_in_executor(
+                self._executor, self._prepare, game_frame, self.scaler.scale
+            )
+            # The video frame holds its own copy of the pixels, so the game can reuse the buffer
+            game_frame.release()
+            if video_frame is None:
+                # Nothing changed on screen, so there's nothing new to encode
+                self.frames_unchanged += 1
+                continue
+            if self._prepared.full():
+                # The encoder is falling behind; drop the oldest frame rather than add latency
+                self._prepared.get_nowait()
+                self.prepared_dropped += 1
+            self._prepared.put_nowait((game_frame, video_frame))
+
+    def _record_latency(self, game_frame: GameFrame, returned_at: float, encode_time: float) -> None:
+        """Record the latency breakdown of a frame that was the first to show an input"""
+        event = game_frame.input
+        if event is None or game_frame.step_started_at is None:
+            return
+        queueing = game_frame.step_started_at - event.received_at
+        step = game_frame.timestamp - game_frame.step_started_at
+        convert = returned_at - game_frame.timestamp
+        self.latency.record("queueing", queueing)
+        self.latency.record("step", step)
+        self.latency.record("convert", convert)
+        self.latency.record("encode", encode_time)
+        total = queueing + step + convert + encode_time
+
+        # The time on the wire is only known once the client's clock has been synchronised
+        if self.clock.rtt_ms is None:
+            return
+        send = self.clock.rtt_ms / 2000
+        self.latency.record("send", send)
+        total += send
+        if event.client_ts is None:
+            return
+        client_ts = self.clock.to_local_ms(event.client_ts)
+        if client_ts is None:
+            return
+        received_ms = (time.time() - (time.monotonic() - event.received_at)) * 1000
+        network_in = (received_ms - client_ts) / 1000
+        self.latency.record("network_in", network_in)
+        self.latency.record("total", total + network_in)
+
+    async def recv(self) -> VideoFrame:
+        if self._returned_at is not None:
+            # The sender encodes each frame right after recv() returns, before asking for the next one
+            encode_time = time.monotonic() - self._returned_at
+            self.scaler.record_encode_time(encode_time, self.pacer.interval)
+            if self._encoding is not None:
+                self._record_latency(self._encoding, self._returned_at, encode_time)
+                self._encoding = None
+        if self._prepare_task is None:
+            self._prepare_task = asyncio.create_task(self._prepare_frames())
+        while True:
+            try:
+                game_frame, new_frame = await asyncio.wait_for(self._prepared.get(), self.KEEPALIVE_INTERVAL)
+                produced_at = game_frame.timestamp
+                self._encoding = game_frame
+                break
+            except asyncio.TimeoutError:
+                if self._last_frame is None:
+                    continue
+                # Resend the last frame at a low rate while paused or static, so the stream stays alive
+                new_frame = self._last_frame
+                produced_at = time.monotonic()
+                self.keepalives_sent += 1
+                break
+        self._last_frame = new_frame
+        self.pacer.fps = self.game.frame_rate.fps
+        new_frame.pts, new_frame.time_base = self.pacer.timestamp(produced_at)
+        await self.pacer.wait()
+        self.pacer.mark_sent()
+        self._returned_at = time.monotonic()
+        return new_frame
+
+    def stop(self) -> None:
+        super().stop()
+        self.game.remove_dropped_frames_source(self._count_prepared_dropped)
+        if self._prepare_task is not None:
+            self._prepare_task.cancel()
+            self._prepare_task = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+class GameRTCConnection:
+    def __init__(self, game: Any, ice_servers: list[dict] | None = None):
+        self.game = game
+        self.last_heartbeat = datetime.now()
+        self.cleanup_scheduled = False
+        
+        # Configure ICE servers
+        config = RTCConfiguration(
+            iceServers=[RTCIceServer(**server) for server in (ice_servers or [])]
+        )
+        self.pc = RTCPeerConnection(configuration=config)
+        self.data_channel: RTCDataChannel | None = None
+        self.input_protocol = INPUT_PROTOCOL_JSON
+        self._report_task: asyncio.Task | None = None
+        self.last_input_at = time.monotonic()
+        
+        # Add video track
+        self.video_track = GameVideoTrack(self.game)
+        self.pc.addTrack(self.video_track)
+        
+        @self.pc.on("datachannel")
+        def on_datachannel(channel: RTCDataChannel):
+            self.data_channel = channel
+            if self._report_task is None:
+                self._report_task = asyncio.ensure_future(self._report_latency())
+            
+            @channel.on("message")
+            def on_message(message):
+                if isinstance(message, bytes):
+                    self.handle_binary_input(message)
+                    return
+                    
+                try:
+                    data = json.loads(message)
+                    if data["type"] == "heartbeat":
+                        self.last_heartbeat = datetime.now()
+                    elif data["type"] == "hello":
+                        self.negotiate_input_protocol(data.get("protocols", []))
+                    elif data["type"] == "pong":
+                        self.video_track.clock.add_sample(data["t"], data["client_t"], time.time() * 1000)
+                    elif data["type"] == "quality":
+                        self.video_track.scaler.set_tier(data["tier"])
+                    else:
+                        self.handle_game_input(data)
+                except Exception as e:
+                    print(f"Error handling message: {e}", file=sys.stderr)
+                    
+        @self.pc.on("connectionstatechange")
+        async def on_connectionstatechange():
+            # print(f"Connection state changed to: {self.pc.connectionState}", file=sys.stderr)
+            if self.pc.connectionState in ("failed", "closed", "disconnected"):
+                await self.cleanup()
+
+    @property
+    def is_stale(self) -> bool:
+        """Check if the connection hasn't received a heartbeat recently"""
+        return datetime.now() - self.last_heartbeat > timedelta(seconds=5)
+
+    def get_stats(self) -> dict[str, Any]:
+        """Get streaming statistics for this session"""
+        return {
+            "video": self.video_track.pacer.stats(),
+            "frame_rate": self.game.frame_rate.stats(),
+            "quality": self.video_track.scaler.stats(),
+            "stages": self.game.stage_stats(),
+            "input_wait": self.game.input_wait.summary(),
+            "frames_dropped": self.game.frames_dropped,
+            "prepared_frames_dropped": self.video_track.prepared_dropped,
+            "frames_unchanged": self.video_track.frames_unchanged,
+            "keepalives_sent": self.video_track.keepalives_sent,
+            "rtt_ms": self.video_track.clock.rtt_ms,
+            "clock_offset_ms": self.video_track.clock.offset_ms,
+            "latency": self.video_track.latency.summary(),
+            "idle_s": time.monotonic() - self.last_input_at,
+        }
+
+    async def _report_latency(self):
+        """Ping the client to synchronise clocks, and send it the latency histograms, once a second"""
+        while True:
+            channel = self.data_channel
+            if channel is not None and channel.readyState == "open":
+                channel.send(json.dumps({"type": "ping", "t": time.time() * 1000}))
+                channel.send(json.dumps({"type": "latency", "stages": self.video_track.latency.summary()}))
+            await asyncio.sleep(1)
+
+    def handle_game_input(self, data: dict):
+        """Handle a game input event from the JSON protocol"""
+        try:
+            input_type = JSON_INPUT_TYPES[data["type"]]
+            client_ts = data.get("t")
+            seq = data.get("seq")
+            if input_type == InputType.MOUSEMOVE:
+                self.handle_input_event(input_type, 0, data["movementX"], data["movementY"], client_ts, seq)
+            elif input_type in (InputType.KEYDOWN, InputType.KEYUP):
+                self.handle_input_event(input_type, data["key"], client_ts=client_ts, seq=seq)
+            else:
+                self.handle_input_event(input_type, data["button"], client_ts=client_ts, seq=seq)
+        except Exception as e:
+            print(f"Error handling input: {e}", file=sys.stderr)
+
+    def handle_binary_input(self, message: bytes):
+        """Handle a batch of game input events from the binary protocol"""
+        try:
+            for input_type, code, dx, dy, client_ts, seq in INPUT_STRUCT.iter_unpack(message):
+                self.handle_input_event(input_type, code, dx, dy, client_ts, seq)
+        except Exception as e:
+            print(f"Error handling binary input: {e}", file=sys.stderr)
+
+    def handle_input_event(
+        self,
+        input_type: int,
+        code: int,
+        dx: float = 0,
+        dy: float = 0,
+        client_ts: float | None = None,
+        seq: int | None = None,
+    ):
+        """Forward an input event to the game's input buffer"""
+        self.last_input_at = time.monotonic()
+        if input_type == InputType.MOUSEMOVE:
+            # Motion is accumulated and consumed as a single delta per step
+            self.game.add_mouse_motion(dx, dy, client_ts, seq)
+        elif input_type in (InputType.KEYDOWN, InputType.KEYUP):
+            pygame_key = JS_TO_PYGAME_KEY_MAP.get(code)
+            if pygame_key is not None:
+                self.game.post_input(InputType(input_type), pygame_key, client_ts, seq)
+        elif input_type in (InputType.MOUSEDOWN, InputType.MOUSEUP):
+            pygame_button = JS_TO_PYGAME_BUTTON_MAP.get(code)
+            if pygame_button is not None:
+                self.game.post_input(InputType(input_type), pygame_button, client_ts, seq)
+
+    def negotiate_input_protocol(self, protocols: list[str]):
+        """Pick the input protocol for the data channel from those the client supports"""
+        if INPUT_PROTOCOL_BINARY in protocols:
+            self.input_protocol = INPUT_PROTOCOL_BINARY
+        else:
+            self.input_protocol = INPUT_PROTOCOL_JSON
+        if self.data_channel is not None:
+            self.data_channel.send(json.dumps({"type": "hello", "protocol": self.input_protocol}))
+
+    async def notify_suspended(self, timeout: float = 1.0):
+        """Tell the client the session was suspended, so it can offer to resume it"""
+        if self.data_channel is None or self.data_channel.readyState != "open":
+            return
+        self.data_channel.send(json.dumps({"type": "suspended"}))
+        # Let the message go out before the connection is closed
+        deadline = time.monotonic() + timeout
+        while self.data_channel.bufferedAmount > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+
+    async def handle_offer(self, sdp: str, type_: str):
+        """Handle incoming WebRTC offer"""
+        offer = RTCSessionDescription(sdp=sdp, type=type_)
+        await self.pc.setRemoteDescription(offer)
+        
+        answer = await self.pc.createAnswer()
+        await self.pc.setLocalDescription(answer)
+        
+        return {
+            "sdp": self.pc.localDescription.sdp,
+            "type": self.pc.localDescription.type
+        }
+
+    async def cleanup(self):
+        """Cleanup resources"""
+        if self.cleanup_scheduled:
+            return
+            
+        self.cleanup_scheduled = True
+        if self._report_task is not None:
+            self._report_task.cancel()
+            self._report_task = None
+        if self.pc.connectionState != "closed":
+            await self.pc.close()
+        self.video_track.stop()
+        # Game cleanup will be handled by the main process
@@ -3,6 +3,7 @@ from collections import defaultdict
 import json
 import os
 import pathlib
+import shutil
 import sys
 import uuid
 import yaml
@@ -26,6 +27,10 @@ from fastapi.middleware.cors import CORSMiddleware
 from dweam.log_config import get_logger
 from dweam.utils.entrypoint import load_games, get_cache_dir
 from dweam.worker import GameWorker
+from dweam.worker_pool import WorkerPool
+from dweam.admission import AdmissionController
+from dweam.supervisor import WorkerSupervisor
+from dweam.fork_server import stop_fork_servers
 from contextlib import asynccontextmanager
 from dweam.utils.venv import get_venv_path
 from sse_starlette.sse import EventSourceResponse
@@ -100,10 +105,25 @@ async def lifespan(app: FastAPI):
     global game_loading_thread
     game_loading_thread = threading.Thread(target=_load_games)
     game_loading_thread.start()
+    # Suspended sessions don't outlive the server
+    shutil.rmtree(get_snapshot_dir(), ignore_errors=True)
+    worker_pool.start()
+    admission.start()
+    supervisor.start()
+    background_tasks = [asyncio.create_task(cleanup_stale_workers())]
+    if SESSION_IDLE_SUSPEND > 0:
+        background_tasks.append(asyncio.create_task(suspend_idle_sessions()))
     yield
     # Clean up active games on shutdown
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await supervisor.stop()
+    await admission.stop()
+    await worker_pool.stop()
     await asyncio.gather(*[worker.cleanup() for worker in active_workers.values()])
     active_workers.clear()
+    await stop_fork_servers()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -117,8 +137,25 @@ app.add_middleware(
     max_age=86400,  # Cache preflight requests for 24 hours
 )
 
+@dataclass
+class SuspendedSession:
+    """A session whose game state was saved to disk and its worker stopped, to be resumed by a later offer"""
+    game_type: str
+    game_id: str
+    snapshot: pathlib.Path
+    suspended_at: float  # time()
+
 # Global worker management
 active_workers: dict[str, GameWorker] = {}
+suspended_sessions: dict[str, SuspendedSession] = {}
+# Suspend sessions without input for this many seconds (0 to never), and drop their snapshots after a day
+SESSION_IDLE_SUSPEND = float(os.environ.get("SESSION_IDLE_SUSPEND", 0))
+SUSPENDED_SESSION_TTL = float(os.environ.get("SUSPENDED_SESSION_TTL", 24 * 60 * 60))
+worker_pool = WorkerPool.from_env(log)
+admission = AdmissionController.from_env(log, worker_pool)
+# Only pre-start workers the host has memory to spare for
+worker_pool.has_room = admission.has_room_for_pooled
+supervisor = WorkerSupervisor(log, active_workers, lambda session_id: cleanup_worker(session_id, log))
 
 @app.get('/status')
 async def status() -> StatusResponse:
@@ -167,6 +204,7 @@ async def get_game(type: str, id: str) -> GameInfoWithMetadata:
 
 async def cleanup_worker(session_id: str, log: BoundLogger) -> None:
     """Clean up a game worker and its resources"""
+    admission.release(session_id)
     if session_id not in active_workers:
         log.warning("Received cleanup request for unknown session", session_id=session_id)
         return
@@ -175,6 +213,23 @@ async def cleanup_worker(session_id: str, log: BoundLogger) -> None:
     await worker.cleanup()
     active_workers.pop(session_id, None)
 
+def get_snapshot_dir() -> pathlib.Path:
+    return get_cache_dir() / "snapshots"
+
+async def suspend_session(session_id: str, log: BoundLogger) -> None:
+    """Save a session's game state, and stop its worker until the session is resumed"""
+    worker = active_workers[session_id]
+    snapshot = get_snapshot_dir() / f"{session_id}.state"
+    size = await worker.suspend(snapshot)
+    suspended_sessions[session_id] = SuspendedSession(
+        game_type=worker.game_type,
+        game_id=worker.game_id,
+        snapshot=snapshot,
+        suspended_at=time(),
+    )
+    log.info("Suspended session", session_id=session_id, bytes=size)
+    await cleanup_worker(session_id, log)
+
 # WebRTC server endpoint
 @app.post("/offer/{type}/{id}")
 async def offer(
@@ -194,36 +249,86 @@ async def offer(
     session_id = str(uuid.uuid4())[:8]
     log = log.bind(session_id=session_id)
 
+    # The session this offer resumes, if any
+    resume = params.get("resume")
+
     async def event_generator():
-        # Create and start game worker
-        worker = GameWorker(
-            log=log,
-            game_info=game_info,
-            session_id=session_id,
-            game_type=type,
-            game_id=id,
-            venv_path=get_venv_path(log)
-        )
+        offer_received = time()
+
+        # Taken while this offer uses it, and put back unless the session is resumed
+        suspended = suspended_sessions.get(resume) if resume else None
+        if suspended is not None and (suspended.game_type, suspended.game_id) == (type, id):
+            suspended_sessions.pop(resume)
+            log.info("Resuming session", resumed_session_id=resume)
+        else:
+            suspended = None
+
+        # Wait for the host to have room for the session
+        ticket = admission.request(session_id, type, id)
+        try:
+            while not ticket.admitted.is_set():
+                yield {
+                    "event": "queue",
+                    "data": json.dumps({
+                        "position": admission.position(ticket),
+                        "eta": admission.eta(ticket),
+                    })
+                }
+                try:
+                    await asyncio.wait_for(ticket.admitted.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            # The client went away while queued
+            admission.release(session_id)
+            if suspended is not None:
+                suspended_sessions[resume] = suspended
+            raise
+
+        # Claim a pre-started worker if one is ready, otherwise create and start a new one
+        worker = worker_pool.claim(type, id, game_info, session_id, log)
+        pool_hit = worker is not None
+        if worker is None:
+            worker = GameWorker(
+                log=log,
+                game_info=game_info,
+                session_id=session_id,
+                game_type=type,
+                game_id=id,
+                venv_path=get_venv_path(log)
+            )
         active_workers[session_id] = worker
+        admission.attach(session_id, worker)
         
         # Start worker.run in a separate task
-        run_task = asyncio.create_task(worker.run(offer))
-        last_message = None
+        run_task = asyncio.create_task(
+            worker.run(offer, snapshot=suspended.snapshot if suspended is not None else None)
+        )
+        sent_phases: set[str] = set()
+
+        def new_phases():
+            """Events for the startup phases the worker has completed since last checked"""
+            for phase, timestamp in sorted(worker.phases.items(), key=lambda item: item[1]):
+                if phase not in sent_phases:
+                    sent_phases.add(phase)
+                    yield {
+                        "event": "phase",
+                        "data": json.dumps({"phase": phase, "timestamp": timestamp})
+                    }
 
         try:
-            # Stream logs while waiting for run_task to complete
+            # Stream startup phases while waiting for run_task to complete
             while not run_task.done():
-                if worker.last_log_line != last_message:
-                    last_message = worker.last_log_line
-                    if last_message:
-                        yield {
-                            "event": "loading",
-                            "data": last_message
-                        }
+                for event in new_phases():
+                    yield event
                 await asyncio.sleep(0.1)
 
             # Get and send the answer
             answer = await run_task
+            worker_pool.record_startup(pool_hit, time() - offer_received)
+            if suspended is not None:
+                suspended.snapshot.unlink(missing_ok=True)
+                suspended = None
             yield {
                 "event": "answer",
                 "data": json.dumps({
@@ -233,18 +338,18 @@ async def offer(
                 })
             }
 
-            # Keep streaming logs until client disconnects
+            # Keep streaming phases (such as the first frame) until client disconnects
             while True:
-                if worker.last_log_line != last_message:
-                    last_message = worker.last_log_line
-                    if last_message:
-                        yield {
-                            "event": "loading",
-                            "data": last_message
-                        }
+                for event in new_phases():
+                    yield event
                 await asyncio.sleep(0.1)
 
-        except Exception as e:
+        except BaseException as e:
+            if suspended is not None:
+                # Not resumed (the client went away or the worker failed), so it can be retried
+                suspended_sessions[resume] = suspended
+            if not isinstance(e, Exception):
+                raise
             log.exception("Error starting game worker")
             await cleanup_worker(session_id, log)
             yield {
@@ -288,24 +393,47 @@ async def cleanup_stale_workers() -> None:
     """Periodically check for and cleanup stale game workers"""
     while True:
         try:
-            await asyncio.sleep(30)  # Check every 30 seconds
+            await asyncio.sleep(10)  # Check every 10 seconds
             
+            # Heartbeats come from the supervisor's pings
             stale_sessions = [
                 session_id for session_id, worker in active_workers.items()
-                if (datetime.now() - worker.last_heartbeat > timedelta(seconds=5) 
+                if (datetime.now() - worker.last_heartbeat > timedelta(seconds=WorkerSupervisor.HEARTBEAT_TIMEOUT) 
                     and not worker.cleanup_scheduled)
             ]
             
             for session_id in stale_sessions:
                 log.info("Cleaning up stale game worker", session_id=session_id)
                 await cleanup_worker(session_id, log)
+
+            expired_sessions = [
+                session_id for session_id, suspended in suspended_sessions.items()
+                if time() - suspended.suspended_at > SUSPENDED_SESSION_TTL
+            ]
+            for session_id in expired_sessions:
+                suspended_sessions.pop(session_id).snapshot.unlink(missing_ok=True)
                 
         except Exception as e:
             log.error("Error in cleanup task", error=str(e))
 
-@app.on_event("startup")
-async def start_cleanup_task():
-    asyncio.create_task(cleanup_stale_workers())
+async def suspend_idle_sessions() -> None:
+    """Periodically suspend sessions that haven't had any input for `SESSION_IDLE_SUSPEND` seconds"""
+    while True:
+        await asyncio.sleep(30)
+        for session_id, worker in list(active_workers.items()):
+            if worker.cleanup_scheduled:
+                continue
+            try:
+                stats = await worker.get_stats()
+                if (
+                    stats
+                    and stats.get("can_suspend")
+                    and stats.get("idle_s") is not None
+                    and stats["idle_s"] >= SESSION_IDLE_SUSPEND
+                ):
+                    await suspend_session(session_id, log)
+            except Exception as e:
+                log.error("Error suspending idle session", session_id=session_id, error=str(e))
 
 @app.get('/game/{type}/{id}/params/schema')
 async def get_params_schema(
@@ -361,6 +489,86 @@ async def update_game_params(
                  error=str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post('/quality/{session_id}')
+async def set_session_quality(
+    request: Request,
+    session_id: str = Path(...),
+    log: BoundLogger = Depends(logger_dependency),
+):
+    """Set the output resolution tier of a game session ("auto", "native", "three_quarters" or "half")"""
+    worker = active_workers.get(session_id)
+    if not worker:
+        raise HTTPException(status_code=404, detail="Game session not found")
+
+    params = await request.json()
+
+    try:
+        await worker.set_quality(params['tier'])
+        return {"status": "success"}
+    except (KeyError, ValidationError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        log.error("Error setting session quality", 
+                 session_id=session_id, 
+                 error=str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post('/suspend/{session_id}')
+async def suspend(
+    session_id: str = Path(...),
+    log: BoundLogger = Depends(logger_dependency),
+):
+    """Suspend a session to disk, freeing its worker; an offer with `resume` set to the session id resumes it"""
+    if session_id not in active_workers:
+        raise HTTPException(status_code=404, detail="Game session not found")
+    try:
+        await suspend_session(session_id, log)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "suspended", "session_id": session_id}
+
+@app.get('/pool/stats')
+async def get_pool_stats() -> dict:
+    """Get worker pool sizes, hit/miss counts and session startup times"""
+    return worker_pool.stats()
+
+@app.get('/admission/stats')
+async def get_admission_stats() -> dict:
+    """Get the host's capacity, what's charged to running sessions, the queue length and per-game cost estimates"""
+    return admission.stats()
+
+@app.get('/supervisor/stats')
+async def get_supervisor_stats() -> dict:
+    """Get how many worker processes of each game exited, crashed or hung"""
+    return supervisor.stats()
+
+@app.get('/startup/stats')
+async def get_startup_stats() -> dict:
+    """Get how long each phase of starting a session took, per game"""
+    return {
+        f"{game_type}/{game_id}": tracker.summary()
+        for (game_type, game_id), tracker in GameWorker.startup_phases.items()
+    }
+
+@app.get('/stats/{session_id}')
+async def get_session_stats(
+    session_id: str = Path(...),
+    log: BoundLogger = Depends(logger_dependency),
+) -> dict:
+    """Get streaming statistics for a game session"""
+    worker = active_workers.get(session_id)
+    if not worker:
+        raise HTTPException(status_code=404, detail="Game session not found")
+
+    try:
+        stats = await worker.get_stats()
+        return {"session_id": session_id, "stats": stats}
+    except Exception as e:
+        log.error("Error getting session stats", 
+                 session_id=session_id, 
+                 error=str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get('/thumb/{type}/{id}.{ext}')
 async def get_thumbnail(
     type: str,
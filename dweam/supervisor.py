@@ -0,0 +1,178 @@
+import asyncio
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Awaitable, Callable
+
+from structlog.stdlib import BoundLogger
+
+from dweam.worker import GameWorker
+
+
+GameKey = tuple[str, str]  # (game type, game id)
+
+
+@dataclass
+class GameHealth:
+    """How the worker processes of a game have ended"""
+    exits: int = 0  # Exited on their own, saying so
+    crashes: int = 0  # Exited without saying so
+    hangs: int = 0  # Stopped answering pings, and were killed
+
+
+class WorkerSupervisor:
+    """
+    Watches the worker processes of running sessions over their control channels.
+
+    Every `PING_INTERVAL` seconds, each process that has finished starting up is pinged. A reply
+    within `PING_TIMEOUT` is a heartbeat for the sessions the worker reports running (and for those
+    still starting); sessions of a multi-session process missing from its reply have ended, and are
+    cleaned up. A process that misses `MAX_MISSED_PINGS` replies in a row is considered hung and
+    killed, and one that has exited is reaped; either way its sessions are cleaned up.
+    """
+
+    PING_INTERVAL = 5.0
+    PING_TIMEOUT = 5.0
+    MAX_MISSED_PINGS = 3
+    # Sessions without a heartbeat for this long are considered stale, in seconds
+    HEARTBEAT_TIMEOUT = 30.0
+
+    def __init__(
+        self,
+        log: BoundLogger,
+        workers: dict[str, GameWorker],
+        cleanup: Callable[[str], Awaitable[None]],
+    ):
+        self.log = log.bind(component="supervisor")
+        self.workers = workers
+        self.cleanup = cleanup
+
+        self._missed: dict[GameWorker, int] = {}
+        self._health: defaultdict[GameKey, GameHealth] = defaultdict(GameHealth)
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.PING_INTERVAL)
+            try:
+                await self.check()
+            except Exception:
+                self.log.exception("Error supervising workers")
+
+    async def check(self) -> None:
+        """Ping every worker process once, and deal with those that have exited or hung"""
+        # Sessions of multi-session games share their host's process
+        processes: dict[GameWorker, list[tuple[str, GameWorker]]] = {}
+        now = datetime.now()
+        for session_id, worker in list(self.workers.items()):
+            if worker.cleanup_scheduled:
+                continue
+            if worker.process is None:
+                # Still being spawned (e.g. creating its venv, or waiting on a fork server), so there's
+                # nothing to ping yet; keep it from looking stale meanwhile
+                worker.last_heartbeat = now
+                continue
+            processes.setdefault(worker.host or worker, []).append((session_id, worker))
+
+        for owner in list(self._missed):
+            if owner not in processes:
+                del self._missed[owner]
+
+        await asyncio.gather(*[
+            self._check_process(owner, sessions) for owner, sessions in processes.items()
+        ])
+
+    async def _check_process(self, owner: GameWorker, sessions: list[tuple[str, GameWorker]]) -> None:
+        assert owner.process is not None
+        key = (owner.game_type, owner.game_id)
+        now = datetime.now()
+
+        if owner.process.returncode is not None:
+            if owner.exit_reason is not None:
+                self._health[key].exits += 1
+            else:
+                self._health[key].crashes += 1
+                self.log.warning(
+                    "Worker process crashed",
+                    pid=owner.process.pid,
+                    returncode=owner.process.returncode,
+                    game_type=owner.game_type,
+                    game_id=owner.game_id,
+                )
+            await self._clean_up(sessions)
+            return
+
+        if not owner.is_ready:
+            # Still importing the game, which may take a while
+            for _, worker in sessions:
+                worker.last_heartbeat = now
+            return
+
+        # Sessions that were streaming before the ping, and should be in its reply unless they've ended
+        answered = {
+            session_id for session_id, worker in sessions
+            if worker.is_multi_session and "answer_ready" in worker.phases
+        }
+        try:
+            running = await owner.ping(self.PING_TIMEOUT)
+        except Exception as e:
+            if owner.process.returncode is not None:
+                # Exited while being pinged; reaped next time
+                return
+            missed = self._missed.get(owner, 0) + 1
+            self._missed[owner] = missed
+            self.log.warning("Worker missed a ping", pid=owner.process.pid, missed=missed, error=str(e) or type(e).__name__)
+            if missed >= self.MAX_MISSED_PINGS:
+                self._health[key].hangs += 1
+                self.log.error(
+                    "Worker process hung; killing it",
+                    pid=owner.process.pid,
+                    game_type=owner.game_type,
+                    game_id=owner.game_id,
+                )
+                owner.process.kill()
+                del self._missed[owner]
+                await self._clean_up(sessions)
+            return
+
+        self._missed[owner] = 0
+        ended = []
+        for session_id, worker in sessions:
+            if session_id in answered and worker.session_id not in running:
+                ended.append((session_id, worker))
+            else:
+                worker.last_heartbeat = now
+        if ended:
+            # The worker closed them (e.g. their client went away), but keeps running for the others
+            self.log.info("Cleaning up ended sessions", pid=owner.process.pid, sessions=[session_id for session_id, _ in ended])
+            await self._clean_up(ended)
+
+    async def _clean_up(self, sessions: list[tuple[str, GameWorker]]) -> None:
+        for session_id, _ in sessions:
+            try:
+                await self.cleanup(session_id)
+            except Exception:
+                self.log.exception("Error cleaning up session", session_id=session_id)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            f"{game_type}/{game_id}": {
+                "exits": health.exits,
+                "crashes": health.crashes,
+                "hangs": health.hangs,
+            }
+            for (game_type, game_id), health in self._health.items()
+        }
@@ -0,0 +1,98 @@
+import os
+import sys
+from dataclasses import dataclass
+
+
+# Size the thread pools of common numeric libraries, which read them when first loaded
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+)
+
+
+@dataclass(frozen=True)
+class CpuBudget:
+    """The threads a worker process may use for compute, and the CPUs it's pinned to (None for any)"""
+    threads: int
+    cpus: tuple[int, ...] | None = None
+
+    def env(self) -> dict[str, str]:
+        return {name: str(self.threads) for name in THREAD_ENV_VARS}
+
+
+def available_cpus() -> list[int]:
+    """The CPUs the current process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_cpu_budgets(cpus: list[int], weights: list[int], pin: bool = False) -> list[CpuBudget]:
+    """
+    Split CPUs between worker processes in proportion to their weights (the sessions each hosts).
+
+    While there are at least as many CPUs as sessions, every process gets a contiguous block of CPUs
+    with a thread per CPU, and is pinned to it if `pin`. Beyond that, processes get a thread per
+    session they would have had a whole CPU for (at least one), and the OS schedules them freely.
+    Processes without sessions (weight 0) get a single, unpinned thread.
+    """
+    total = sum(weights)
+    if total == 0:
+        return [CpuBudget(threads=1) for _ in weights]
+    if total > len(cpus):
+        return [CpuBudget(threads=max(1, len(cpus) * weight // total)) for weight in weights]
+
+    budgets = []
+    start = 0
+    cumulative = 0
+    for weight in weights:
+        cumulative += weight
+        # Rounding the cumulative share hands out every CPU, without any block overlapping the next
+        end = len(cpus) * cumulative // total
+        block = tuple(cpus[start:end])
+        start = end
+        budgets.append(CpuBudget(threads=max(1, len(block)), cpus=block if pin and block else None))
+    return budgets
+
+
+# The CPUs the process could run on before it was first pinned
+_initial_cpus: set[int] | None = None
+
+
+def apply_cpu_budget(threads: int, cpus: list[int] | None = None) -> None:
+    """
+    Resize the thread pools of this process's numeric libraries to `threads`, and pin all of
+    its threads to `cpus` (or unpin them, if None), where the platform supports it
+    """
+    global _initial_cpus
+    # For libraries loaded from now on
+    os.environ.update(CpuBudget(threads).env())
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        pass
+    else:
+        # OpenMP and BLAS pools that are already running
+        threadpool_limits(limits=threads)
+
+    if not hasattr(os, "sched_setaffinity"):
+        return
+    if _initial_cpus is None:
+        _initial_cpus = os.sched_getaffinity(0)
+    target = set(cpus) if cpus else _initial_cpus
+    try:
+        # Affinity is per thread, and threads only inherit it when they're created
+        thread_ids = [int(tid) for tid in os.listdir("/proc/self/task")]
+    except OSError:
+        thread_ids = [0]
+    for thread_id in thread_ids:
+        try:
+            os.sched_setaffinity(thread_id, target)
+        except OSError:
+            # The thread has exited
+            pass
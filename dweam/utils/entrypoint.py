@@ -304,8 +304,14 @@ def load_metadata_from_package(package_path: Path) -> PackageMetadata | None:
     return None
 
 
-def load_game_implementation(entrypoint: str) -> type:
-    """Load a game implementation from an entrypoint string (e.g. 'package.module:Class')"""
+def load_game_implementation(entrypoint: str, module_dir: Path | None = None) -> type:
+    """
+    Load a game implementation from an entrypoint string (e.g. 'package.module:Class').
+
+    `module_dir`, the installed package's directory, is used as a fallback import location.
+    """
+    if module_dir is not None and str(module_dir.parent) not in sys.path:
+        sys.path.append(str(module_dir.parent))
     try:
         module_path, class_name = entrypoint.split(':')
         module = importlib.import_module(module_path)
@@ -0,0 +1,359 @@
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Literal, Union
+
+import numpy as np
+import pygame
+from av.video.frame import VideoFrame
+
+
+if TYPE_CHECKING:
+    import torch
+
+
+PixelFormat = Literal["rgb24", "yuv420p"]
+
+
+@dataclass
+class YUV420Frame:
+    """A frame in planar YUV 4:2:0 (BT.601, limited range), for games that render YUV natively"""
+    y: np.ndarray  # (height, width) uint8
+    u: np.ndarray  # (height // 2, width // 2) uint8
+    v: np.ndarray  # (height // 2, width // 2) uint8
+
+
+FrameImage = Union[pygame.Surface, np.ndarray, YUV420Frame, "torch.Tensor"]
+
+
+def tensor_to_ndarray(tensor: Any) -> np.ndarray:
+    """
+    Get a NumPy view of a torch tensor without importing torch.
+
+    CPU tensors are shared without copying; tensors on other devices are copied to the CPU once.
+    """
+    if not type(tensor).__module__.startswith("torch") or not hasattr(tensor, "detach"):
+        raise TypeError(f"Unsupported frame type: {type(tensor).__name__}")
+    return tensor.detach().cpu().numpy()
+
+
+def as_hwc_uint8(array: np.ndarray) -> np.ndarray:
+    """Validate a (height, width, rgb[a]) uint8 frame array, dropping any alpha channel"""
+    if array.dtype != np.uint8:
+        raise TypeError(f"Frame arrays must be uint8, got {array.dtype}")
+    if array.ndim != 3 or array.shape[2] not in (3, 4):
+        raise ValueError(f"Frame arrays must have shape (height, width, 3 or 4), got {array.shape}")
+    if array.shape[2] == 4:
+        array = array[..., :3]
+    return array
+
+
+def frame_digest(image: FrameImage) -> int:
+    """
+    Get a cheap checksum of a frame's pixels, to detect frames that didn't change.
+
+    Takes frames as handed off by the game thread, never a surface the game may still be drawing to.
+    """
+    if isinstance(image, pygame.Surface):
+        raise TypeError("Surfaces must be copied on the game thread before they're hashed")
+    if isinstance(image, YUV420Frame):
+        planes = (image.y, image.u, image.v)
+    elif isinstance(image, np.ndarray):
+        planes = (image,)
+    else:
+        planes = (tensor_to_ndarray(image),)
+    digest = 0
+    for plane in planes:
+        digest = zlib.crc32(np.ascontiguousarray(plane), digest)
+    return digest
+
+
+def copy_surface(surface: pygame.Surface, out: np.ndarray | None = None) -> np.ndarray:
+    """
+    Copy a surface's pixels into a (height, width, rgb) uint8 array, `out` if given.
+
+    The surface is locked while it's read, so this must run on the thread that draws to it.
+    """
+    width, height = surface.get_size()
+    if out is None:
+        out = np.empty((height, width, 3), dtype=np.uint8)
+    try:
+        # A view onto the surface's pixels, indexed (x, y) – no copy
+        pixels = pygame.surfarray.pixels3d(surface)
+    except ValueError:
+        # Surfaces with less than 24 bits per pixel can't be referenced directly
+        pixels = pygame.surfarray.array3d(surface)
+    try:
+        np.copyto(out, pixels.transpose(1, 0, 2))
+    finally:
+        # Release the surface lock held by the pixel view
+        del pixels
+    return out
+
+
+class FrameBufferPool:
+    """
+    Reusable buffers for surfaces copied off the game thread.
+
+    A buffer only goes back into the pool once the frame holding it is released by whoever read it,
+    so it's never overwritten while still being read. Buffers that are never released are simply
+    garbage collected.
+    """
+
+    # Most free buffers kept for reuse
+    MAX_FREE = 4
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._free: list[np.ndarray] = []
+
+    def acquire(self, height: int, width: int) -> np.ndarray:
+        """Get a (height, width, rgb) buffer, reusing a released one if there is one"""
+        with self._lock:
+            while self._free:
+                buffer = self._free.pop()
+                # Buffers of a previous frame size are dropped
+                if buffer.shape[:2] == (height, width):
+                    return buffer
+        return np.empty((height, width, 3), dtype=np.uint8)
+
+    def release(self, buffer: np.ndarray) -> None:
+        """Return a buffer that's no longer read"""
+        with self._lock:
+            if len(self._free) < self.MAX_FREE:
+                self._free.append(buffer)
+
+    def copy_surface(self, surface: pygame.Surface) -> np.ndarray:
+        """Copy a surface into a buffer from the pool (on the thread that draws to the surface)"""
+        width, height = surface.get_size()
+        return copy_surface(surface, self.acquire(height, width))
+
+
+class FrameConverter:
+    """
+    Converts game frames into video frames, reusing the same output buffers for every frame of a session.
+
+    With `pixel_format="yuv420p"` the colorspace conversion is done here with NumPy,
+    so the encoder doesn't need to run its own rgb24 -> yuv420p conversion.
+    """
+
+    def __init__(self, pixel_format: PixelFormat = "rgb24"):
+        self.pixel_format = pixel_format
+        self._buffer: np.ndarray | None = None
+        self._yuv_buffer: np.ndarray | None = None
+        self._luma_scratch: tuple[np.ndarray, np.ndarray] | None = None
+        self._chroma_scratch: tuple[np.ndarray, ...] | None = None
+
+    def _get_buffer(self, height: int, width: int) -> np.ndarray:
+        """Get the output buffer, reallocating only when the frame size changes"""
+        if self._buffer is None or self._buffer.shape[:2] != (height, width):
+            self._buffer = np.empty((height, width, 3), dtype=np.uint8)
+        return self._buffer
+
+    def _get_yuv_buffer(self, height: int, width: int) -> np.ndarray:
+        """Get the yuv420p output buffer and scratch space, reallocating only when the frame size changes"""
+        shape = (height * 3 // 2, width)
+        if self._yuv_buffer is None or self._yuv_buffer.shape != shape:
+            self._yuv_buffer = np.empty(shape, dtype=np.uint8)
+            self._luma_scratch = (
+                np.empty((height, width), dtype=np.int32),
+                np.empty((height, width), dtype=np.int32),
+            )
+            self._chroma_scratch = tuple(
+                np.empty((height // 2, width // 2), dtype=np.int32) for _ in range(5)
+            )
+        return self._yuv_buffer
+
+    def convert(self, surface: pygame.Surface) -> np.ndarray:
+        """
+        Copy the surface pixels into the output buffer in row-major (height, width, rgb) order.
+
+        The returned array is owned by the converter and is overwritten by the next call.
+        """
+        width, height = surface.get_size()
+        return copy_surface(surface, self._get_buffer(height, width))
+
+    def _split_planes(self, buffer: np.ndarray, height: int, width: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Get views onto the Y, U and V planes of a yuv420p buffer, in the layout expected by `VideoFrame.from_ndarray`"""
+        flat = buffer.reshape(-1)
+        u_start = width * height
+        v_start = u_start + u_start // 4
+        return (
+            flat[:u_start].reshape(height, width),
+            flat[u_start:v_start].reshape(height // 2, width // 2),
+            flat[v_start:].reshape(height // 2, width // 2),
+        )
+
+    def to_yuv420(self, rgb: np.ndarray) -> np.ndarray:
+        """
+        Convert a (height, width, rgb) uint8 array into a (height * 3/2, width) yuv420p buffer.
+
+        Odd trailing rows/columns are cropped, as 4:2:0 needs even dimensions.
+        The returned array is owned by the converter and is overwritten by the next call.
+        """
+        height, width = rgb.shape[0] & ~1, rgb.shape[1] & ~1
+        rgb = rgb[:height, :width]
+        out = self._get_yuv_buffer(height, width)
+        assert self._luma_scratch is not None and self._chroma_scratch is not None
+        y_plane, u_plane, v_plane = self._split_planes(out, height, width)
+        r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+
+        # Y = ((66 R + 129 G + 25 B + 128) >> 8) + 16
+        acc, tmp = self._luma_scratch
+        np.multiply(r, 66, out=acc, dtype=np.int32)
+        np.multiply(g, 129, out=tmp, dtype=np.int32)
+        acc += tmp
+        np.multiply(b, 25, out=tmp, dtype=np.int32)
+        acc += tmp
+        acc += 128
+        acc >>= 8
+        acc += 16
+        np.copyto(y_plane, acc, casting="unsafe")
+
+        # Chroma is computed from the sum of each 2x2 block, i.e. 4x the block average
+        sum_r, sum_g, sum_b, acc, tmp = self._chroma_scratch
+        for channel, total in ((r, sum_r), (g, sum_g), (b, sum_b)):
+            np.add(channel[0::2, 0::2], channel[1::2, 0::2], out=total, dtype=np.int32)
+            total += channel[0::2, 1::2]
+            total += channel[1::2, 1::2]
+
+        for plane, (cr, cg, cb) in ((u_plane, (-38, -74, 112)), (v_plane, (112, -94, -18))):
+            np.multiply(sum_r, cr, out=acc)
+            np.multiply(sum_g, cg, out=tmp)
+            acc += tmp
+            np.multiply(sum_b, cb, out=tmp)
+            acc += tmp
+            acc += 512
+            acc >>= 10
+            acc += 128
+            np.copyto(plane, acc, casting="unsafe")
+
+        return out
+
+    def _copy_yuv420(self, frame: YUV420Frame) -> np.ndarray:
+        """Pack a game-provided YUV420Frame into the yuv420p output buffer"""
+        height, width = frame.y.shape[0] & ~1, frame.y.shape[1] & ~1
+        out = self._get_yuv_buffer(height, width)
+        y_plane, u_plane, v_plane = self._split_planes(out, height, width)
+        np.copyto(y_plane, frame.y[:height, :width])
+        np.copyto(u_plane, frame.u[:height // 2, :width // 2])
+        np.copyto(v_plane, frame.v[:height // 2, :width // 2])
+        return out
+
+    def to_rgb(self, image: FrameImage) -> np.ndarray:
+        """
+        Get a frame returned by `Game.step` as a (height, width, rgb) uint8 array.
+
+        Arrays and CPU tensors are passed through without copying; surfaces are copied into the output buffer.
+        """
+        if isinstance(image, pygame.Surface):
+            return self.convert(image)
+        if not isinstance(image, np.ndarray):
+            image = tensor_to_ndarray(image)
+        return as_hwc_uint8(image)
+
+    def to_video_frame(self, image: FrameImage, scale: float = 1.0) -> VideoFrame:
+        """
+        Convert a frame returned by `Game.step` into a video frame in the configured pixel format,
+        optionally downscaled by `scale`
+        """
+        if isinstance(image, YUV420Frame):
+            frame = VideoFrame.from_ndarray(self._copy_yuv420(image), format="yuv420p")
+        else:
+            rgb = self.to_rgb(image)
+            if self.pixel_format == "yuv420p" and scale == 1.0:
+                return VideoFrame.from_ndarray(self.to_yuv420(rgb), format="yuv420p")
+            frame = VideoFrame.from_ndarray(np.ascontiguousarray(rgb), format="rgb24")
+
+        if scale == 1.0:
+            return frame
+        # Resize and convert the colorspace in a single swscale pass
+        width, height = scaled_size(frame.width, frame.height, scale)
+        return frame.reformat(
+            width=width,
+            height=height,
+            format=self.pixel_format,
+            interpolation="AREA",
+        )
+
+
+QualityTier = Literal["native", "three_quarters", "half"]
+
+QUALITY_SCALES: dict[QualityTier, float] = {
+    "native": 1.0,
+    "three_quarters": 0.75,
+    "half": 0.5,
+}
+
+
+def scaled_size(width: int, height: int, scale: float) -> tuple[int, int]:
+    """Get the output size for a scale factor, rounded down to even dimensions for 4:2:0"""
+    return max(2, int(width * scale) & ~1), max(2, int(height * scale) & ~1)
+
+
+class FrameScaler:
+    """
+    Chooses the output resolution tier of a session.
+
+    The tier is either fixed, or picked automatically from how long the encoder takes per frame:
+    encoding over half of the frame interval drops a tier, and encoding under a fifth raises it again.
+    """
+
+    TIERS: list[QualityTier] = ["native", "three_quarters", "half"]
+    # Fractions of the frame interval the encode time is compared against
+    DOWNGRADE_THRESHOLD = 0.5
+    UPGRADE_THRESHOLD = 0.2
+    # Minimum time between automatic tier changes, in seconds
+    COOLDOWN = 2.0
+
+    def __init__(self, tier: QualityTier | Literal["auto"] = "auto"):
+        self.auto = True
+        self.tier: QualityTier = "native"
+        self.set_tier(tier)
+        self._encode_avg: float | None = None
+        self._last_change = time.monotonic()
+
+    @property
+    def scale(self) -> float:
+        return QUALITY_SCALES[self.tier]
+
+    def set_tier(self, tier: QualityTier | Literal["auto"]) -> None:
+        """Fix the output tier, or pass "auto" to have it chosen from encode times"""
+        if tier == "auto":
+            self.auto = True
+            return
+        if tier not in QUALITY_SCALES:
+            raise ValueError(f"Unknown quality tier: {tier}")
+        self.auto = False
+        self.tier = tier
+
+    def record_encode_time(self, duration: float, frame_interval: float) -> None:
+        """Record how long a frame took to encode, adjusting the tier when in auto mode"""
+        if self._encode_avg is None:
+            self._encode_avg = duration
+        else:
+            self._encode_avg += (duration - self._encode_avg) / 16
+
+        now = time.monotonic()
+        if not self.auto or now - self._last_change < self.COOLDOWN:
+            return
+
+        index = self.TIERS.index(self.tier)
+        if self._encode_avg > frame_interval * self.DOWNGRADE_THRESHOLD and index < len(self.TIERS) - 1:
+            index += 1
+        elif self._encode_avg < frame_interval * self.UPGRADE_THRESHOLD and index > 0:
+            index -= 1
+        else:
+            return
+        self.tier = self.TIERS[index]
+        self._last_change = now
+        # Encode times measured at the previous resolution no longer apply
+        self._encode_avg = None
+
+    def stats(self) -> dict[str, str | bool | float | None]:
+        return {
+            "tier": self.tier,
+            "auto": self.auto,
+            "encode_ms": self._encode_avg * 1000 if self._encode_avg is not None else None,
+        }
@@ -0,0 +1,45 @@
+from collections import defaultdict
+from typing import Any
+
+
+class ImportTimeReport:
+    """
+    Summarizes the `-X importtime` output of a worker process.
+
+    With `PYTHONPROFILEIMPORTTIME=1`, Python writes a line to stderr for every module it imports:
+    `import time: <self us> | <cumulative us> | <module, indented by nesting depth>`.
+    Self times are totalled per top-level package, which is where regressions usually come from.
+    """
+
+    PREFIX = "import time:"
+
+    def __init__(self):
+        self.modules = 0
+        self.total_us = 0
+        self._package_us: defaultdict[str, int] = defaultdict(int)
+
+    def feed(self, line: str) -> bool:
+        """Record a line of stderr output; returns False if it isn't import time output"""
+        if not line.startswith(self.PREFIX):
+            return False
+        fields = line[len(self.PREFIX):].split("|")
+        if len(fields) != 3:
+            return True
+        try:
+            self_us = int(fields[0])
+        except ValueError:
+            # The header line
+            return True
+        package = fields[2].strip().split(".")[0]
+        self.modules += 1
+        self.total_us += self_us
+        self._package_us[package] += self_us
+        return True
+
+    def summary(self, top: int = 10) -> dict[str, Any]:
+        packages = sorted(self._package_us.items(), key=lambda item: item[1], reverse=True)[:top]
+        return {
+            "modules": self.modules,
+            "total_ms": self.total_us / 1000,
+            "packages_ms": {package: us / 1000 for package, us in packages},
+        }
@@ -0,0 +1,49 @@
+import time
+from typing import NamedTuple
+
+
+class InputEvent(NamedTuple):
+    """A key or mouse button event queued for the game thread"""
+    type: int  # InputType
+    code: int  # pygame key or mouse button
+    client_ts: float | None = None  # Client timestamp (ms since epoch), if the client sent one
+    received_at: float = 0.0  # time.monotonic() when the worker received the event
+    seq: int | None = None  # Client input sequence number, if the client sent one
+
+
+class InputRing:
+    """
+    Fixed-capacity single-producer, single-consumer ring buffer of input events.
+
+    The producer (the RTC layer on the asyncio thread) only advances `_head` and the consumer
+    (the game thread) only advances `_tail`. Each is a single attribute store, which is atomic
+    under the GIL, so neither side needs a lock. Events pushed while the ring is full are dropped.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._capacity = capacity
+        self._slots: list[InputEvent | None] = [None] * capacity
+        self._head = 0
+        self._tail = 0
+        self.overflowed = 0
+
+    def push(self, event_type: int, code: int, client_ts: float | None = None, seq: int | None = None) -> bool:
+        """Queue an event; returns False if the ring is full and the event was dropped"""
+        head = self._head
+        if head - self._tail >= self._capacity:
+            self.overflowed += 1
+            return False
+        self._slots[head % self._capacity] = InputEvent(event_type, code, client_ts, time.monotonic(), seq)
+        # Publish the slot only once it's written
+        self._head = head + 1
+        return True
+
+    def drain(self) -> list[InputEvent]:
+        """Take all queued events, oldest first"""
+        tail, head = self._tail, self._head
+        events = [self._slots[i % self._capacity] for i in range(tail, head)]
+        self._tail = head
+        return events  # type: ignore[return-value]
+
+    def __len__(self) -> int:
+        return self._head - self._tail
@@ -0,0 +1,131 @@
+import asyncio
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from dweam.utils.input import InputEvent
+
+
+@dataclass
+class GameFrame:
+    """A frame produced by the game thread"""
+    image: Any
+    seq: int
+    timestamp: float  # time.monotonic() when the frame was produced
+    changed: bool | None = None  # Whether the game reported the frame as changed, if it knows
+    # The oldest input first consumed by the step that produced the frame, and when that step started
+    input: InputEvent | None = None
+    step_started_at: float | None = None
+    # Hands the image's buffer back for reuse, once it's no longer read
+    on_release: Callable[[], None] | None = None
+
+    def release(self) -> None:
+        """Let the image's buffer be reused; the image must not be read after this"""
+        on_release, self.on_release = self.on_release, None
+        if on_release is not None:
+            on_release()
+
+
+class FrameMailbox:
+    """
+    Single-slot mailbox handing the latest frame from the game thread to an asyncio consumer.
+
+    The producer never blocks: a new frame overwrites one that hasn't been taken yet,
+    which is counted in `dropped` and released. The consumer is woken via `call_soon_threadsafe`,
+    and releases the frames it takes once it's done reading them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._frame: GameFrame | None = None
+        self._seq = 0
+        self._waiter: tuple[asyncio.AbstractEventLoop, asyncio.Event] | None = None
+
+        self.produced = 0
+        self.dropped = 0
+        # time.time() when the first frame was published
+        self.first_frame_at: float | None = None
+        self._first_frame_waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+
+    def put(
+        self,
+        image: Any,
+        changed: bool | None = None,
+        input: InputEvent | None = None,
+        step_started_at: float | None = None,
+        on_release: Callable[[], None] | None = None,
+    ) -> GameFrame:
+        """Publish a new frame, overwriting any frame that hasn't been consumed yet"""
+        with self._lock:
+            self._seq += 1
+            frame = GameFrame(
+                image=image,
+                seq=self._seq,
+                timestamp=time.monotonic(),
+                changed=changed,
+                input=input,
+                step_started_at=step_started_at,
+                on_release=on_release,
+            )
+            dropped = self._frame
+            if self._frame is not None:
+                self.dropped += 1
+                if changed is False:
+                    # "Unchanged" is relative to the frame being overwritten, which may itself have changed
+                    frame.changed = self._frame.changed
+                if input is None and self._frame.input is not None:
+                    # The input's effect is first shown by this frame instead
+                    frame.input = self._frame.input
+                    frame.step_started_at = self._frame.step_started_at
+            self._frame = frame
+            self.produced += 1
+            waiters = [self._waiter] if self._waiter is not None else []
+            self._waiter = None
+            if self.first_frame_at is None:
+                self.first_frame_at = time.time()
+                waiters += self._first_frame_waiters
+                self._first_frame_waiters = []
+        if dropped is not None:
+            # Never taken, so nothing reads it
+            dropped.release()
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The consumer's loop has been closed
+                pass
+        return frame
+
+    def take_nowait(self) -> GameFrame | None:
+        """Take the pending frame if there is one"""
+        with self._lock:
+            frame = self._frame
+            self._frame = None
+            return frame
+
+    async def take(self) -> GameFrame:
+        """Wait for and take the next frame"""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        while True:
+            with self._lock:
+                frame = self._frame
+                if frame is not None:
+                    self._frame = None
+                    return frame
+                # Registered under the lock, so a concurrent put is guaranteed to wake us
+                event.clear()
+                self._waiter = (loop, event)
+            await event.wait()
+
+    async def first_frame(self) -> float:
+        """Wait for the first frame to be published, without taking it; returns `first_frame_at`"""
+        event = asyncio.Event()
+        with self._lock:
+            if self.first_frame_at is not None:
+                return self.first_frame_at
+            self._first_frame_waiters.append((asyncio.get_running_loop(), event))
+        await event.wait()
+        assert self.first_frame_at is not None
+        return self.first_frame_at
@@ -0,0 +1,43 @@
+import os
+import sys
+
+
+def process_memory() -> dict[str, float | None]:
+    """
+    Get the memory use of the current process, in MiB.
+
+    `uss_mb` (unique set size) counts only pages no other process shares, i.e. what stopping this
+    process would free; `pss_mb` splits shared pages evenly between the processes sharing them.
+    Both are only available on Linux; elsewhere only the peak RSS is reported, where available.
+    """
+    memory: dict[str, float | None] = {"rss_mb": None, "pss_mb": None, "uss_mb": None}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            fields = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1])  # kB
+    except OSError:
+        try:
+            import resource
+        except ImportError:
+            # Windows
+            return memory
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kB elsewhere
+        memory["rss_mb"] = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+        return memory
+    memory["rss_mb"] = fields.get("Rss", 0) / 1024
+    memory["pss_mb"] = fields.get("Pss", 0) / 1024
+    memory["uss_mb"] = (fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)) / 1024
+    return memory
+
+
+def total_memory_mb() -> float | None:
+    """Get the host's physical memory in MiB, where it can be determined"""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        # Windows
+        return None
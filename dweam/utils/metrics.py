@@ -0,0 +1,143 @@
+import asyncio
+import bisect
+from collections import deque
+import time
+from typing import Any, Sequence
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the asyncio event loop runs scheduled callbacks.
+
+    A sleep of `interval` is scheduled repeatedly; any time beyond `interval` that passes before
+    it returns is time the loop spent busy with other work.
+    """
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.samples = 0
+        self.avg_lag = 0.0
+        self.max_lag = 0.0
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - start - self.interval)
+            self.samples += 1
+            self.avg_lag += (lag - self.avg_lag) / min(self.samples, 100)
+            self.max_lag = max(self.max_lag, lag)
+
+    def stats(self) -> dict[str, float | int]:
+        return {
+            "avg_lag_ms": self.avg_lag * 1000,
+            "max_lag_ms": self.max_lag * 1000,
+            "samples": self.samples,
+        }
+
+
+class LatencyHistogram:
+    """Histogram of latencies over fixed, roughly logarithmic buckets"""
+
+    # Upper bounds of the buckets, in milliseconds; the last bucket is unbounded
+    BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, seconds: float) -> None:
+        ms = max(0.0, seconds * 1000)
+        index = bisect.bisect_left(self.BUCKETS_MS, ms)
+        self.counts[index] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, fraction: float) -> float | None:
+        """Get the upper bound of the bucket containing the given percentile, in milliseconds"""
+        if self.count == 0:
+            return None
+        threshold = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= threshold:
+                return self.BUCKETS_MS[index] if index < len(self.BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean_ms": self.total_ms / self.count if self.count else None,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": self.max_ms,
+            "buckets_ms": list(self.BUCKETS_MS),
+            "counts": list(self.counts),
+        }
+
+
+class LatencyTracker:
+    """A set of latency histograms, one per stage of a pipeline"""
+
+    def __init__(self, stages: Sequence[str]):
+        self.histograms = {stage: LatencyHistogram() for stage in stages}
+
+    def record(self, stage: str, seconds: float) -> None:
+        self.histograms[stage].record(seconds)
+
+    def summary(self) -> dict[str, dict[str, Any]]:
+        return {stage: histogram.summary() for stage, histogram in self.histograms.items()}
+
+
+class ClockOffsetEstimator:
+    """
+    Estimates the offset between a remote clock and the local wall clock from ping round trips.
+
+    Each round trip gives the remote time at (approximately) the midpoint of the trip;
+    the sample with the shortest round trip out of the recent ones is the most accurate.
+    """
+
+    def __init__(self, window: int = 16):
+        self._samples: deque[tuple[float, float]] = deque(maxlen=window)
+        self.rtt_ms: float | None = None
+
+    def add_sample(self, sent_ms: float, remote_ms: float, received_ms: float) -> None:
+        """Add a ping sent at `sent_ms` and answered at `remote_ms` (remote clock), received back at `received_ms`"""
+        rtt = received_ms - sent_ms
+        if rtt < 0:
+            return
+        self.rtt_ms = rtt
+        self._samples.append((rtt, remote_ms - (sent_ms + rtt / 2)))
+
+    @property
+    def offset_ms(self) -> float | None:
+        """Remote clock minus local clock, in milliseconds"""
+        if not self._samples:
+            return None
+        return min(self._samples)[1]
+
+    def to_local_ms(self, remote_ms: float) -> float | None:
+        """Convert a remote timestamp to the local wall clock, if the offset is known"""
+        offset = self.offset_ms
+        if offset is None:
+            return None
+        return remote_ms - offset
@@ -0,0 +1,136 @@
+import asyncio
+import time
+from fractions import Fraction
+
+
+VIDEO_CLOCK_RATE = 90000
+VIDEO_TIME_BASE = Fraction(1, VIDEO_CLOCK_RATE)
+
+
+class FramePacer:
+    """
+    Paces frame delivery to a target frame rate.
+
+    Frames are released as soon as they're produced, unless that would exceed the target cadence.
+    RTP timestamps are derived from the production time of each frame rather than the send time,
+    so the receiver plays frames back with the spacing they were generated at.
+    """
+
+    # Smoothing factor for the interval/jitter averages, as used for RTP jitter (RFC 3550)
+    SMOOTHING = 1 / 16
+
+    def __init__(self, fps: float = 30):
+        self.fps = fps
+
+        self._epoch: float | None = None
+        self._last_pts = -1
+        self._last_sent: float | None = None
+
+        self._avg_interval: float | None = None
+        self._jitter = 0.0
+        self.frames_sent = 0
+
+    @property
+    def interval(self) -> float:
+        return 1 / self.fps
+
+    async def wait(self) -> None:
+        """Wait until the next frame may be sent according to the target cadence"""
+        if self._last_sent is None:
+            return
+        delay = self._last_sent + self.interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def timestamp(self, produced_at: float) -> tuple[int, Fraction]:
+        """Get the RTP presentation timestamp for a frame produced at `produced_at` (monotonic)"""
+        if self._epoch is None:
+            self._epoch = produced_at
+        pts = int((produced_at - self._epoch) * VIDEO_CLOCK_RATE)
+        # Timestamps must increase, even if frames are produced out of order
+        pts = max(pts, self._last_pts + 1)
+        self._last_pts = pts
+        return pts, VIDEO_TIME_BASE
+
+    def mark_sent(self) -> None:
+        """Record that a frame was sent, updating the achieved frame rate and jitter"""
+        now = time.monotonic()
+        if self._last_sent is not None:
+            interval = now - self._last_sent
+            if self._avg_interval is None:
+                self._avg_interval = interval
+            else:
+                self._avg_interval += (interval - self._avg_interval) * self.SMOOTHING
+            self._jitter += (abs(interval - self.interval) - self._jitter) * self.SMOOTHING
+        self._last_sent = now
+        self.frames_sent += 1
+
+    def stats(self) -> dict[str, float | int | None]:
+        """Get the achieved frame rate and inter-frame jitter"""
+        return {
+            "target_fps": self.fps,
+            "achieved_fps": 1 / self._avg_interval if self._avg_interval else None,
+            "jitter_ms": self._jitter * 1000,
+            "frames_sent": self.frames_sent,
+        }
+
+
+class FrameRateGovernor:
+    """
+    Adapts the target frame rate to what the game's step() and the encoder can sustain.
+
+    The rate is lowered when steps take longer than a frame interval or frames are dropped
+    before the encoder gets to them, and raised back towards `max_fps` once there's headroom.
+    """
+
+    # Fraction of the frame interval a step may take before the rate is lowered
+    HEADROOM = 0.9
+    # How often the rate is re-evaluated, in seconds
+    UPDATE_INTERVAL = 1.0
+
+    def __init__(
+        self,
+        fps: float = 30,
+        min_fps: float | None = None,
+        max_fps: float | None = None,
+        adaptive: bool = True,
+    ):
+        self.target_fps = fps
+        self.min_fps = min_fps if min_fps is not None else min(fps, 5)
+        self.max_fps = max_fps if max_fps is not None else fps
+        self.adaptive = adaptive
+
+        self.fps = fps
+        self._step_avg: float | None = None
+        self._last_dropped = 0
+        self._last_update = time.monotonic()
+
+    def record_step(self, duration: float, frames_dropped: int) -> None:
+        """Record the duration of a step and the total number of frames dropped so far"""
+        if self._step_avg is None:
+            self._step_avg = duration
+        else:
+            self._step_avg += (duration - self._step_avg) * FramePacer.SMOOTHING
+
+        now = time.monotonic()
+        if not self.adaptive or now - self._last_update < self.UPDATE_INTERVAL:
+            return
+        self._last_update = now
+
+        backpressure = frames_dropped > self._last_dropped
+        self._last_dropped = frames_dropped
+
+        sustainable = self.HEADROOM / self._step_avg if self._step_avg > 0 else self.max_fps
+        if backpressure:
+            fps = self.fps * 0.85
+        else:
+            fps = self.fps * 1.1
+        fps = min(fps, sustainable)
+        self.fps = round(max(self.min_fps, min(self.max_fps, fps)), 1)
+
+    def stats(self) -> dict[str, float | None]:
+        return {
+            "fps": self.fps,
+            "target_fps": self.target_fps,
+            "step_ms": self._step_avg * 1000 if self._step_avg is not None else None,
+        }
@@ -2,6 +2,8 @@ import asyncio
 from asyncio.subprocess import Process
 import json
 import os
+import socket
+import time
 from typing import Optional, Any
 from datetime import datetime, timedelta
 from pathlib import Path
@@ -20,8 +22,12 @@ from dweam.log_config import get_logger
 from dweam.utils.turn import create_turn_credentials, get_turn_stun_urls
 from dweam.constants import JS_TO_PYGAME_KEY_MAP, JS_TO_PYGAME_BUTTON_MAP
 from structlog.stdlib import BoundLogger
-from dweam.commands import Command, Response, SchemaCommand, StopCommand, UpdateParamsCommand, HandleOfferCommand, OfferData, ErrorResponse
+from dweam.commands import STARTUP_PHASES, GameEntrypoint, Command, WorkerMessage, PhaseEvent, ExitEvent, PingCommand, SuspendCommand, CpuBudgetCommand, SchemaCommand, StopCommand, UpdateParamsCommand, HandleOfferCommand, StatsCommand, SetQualityCommand, PrepareCommand, OfferData, ErrorResponse
 from dweam.utils.process import get_asyncio_subprocess_flags
+from dweam.utils.importtime import ImportTimeReport
+from dweam.utils.metrics import LatencyTracker
+from dweam.utils.cpu import CpuBudget, available_cpus, plan_cpu_budgets
+from dweam.fork_server import ForkedProcess, fork_server_enabled, get_fork_server
 
 def is_debug_build() -> bool:
     """Detect if we're running the debug build based on executable name"""
@@ -32,6 +38,17 @@ def is_debug_build() -> bool:
     return True  # In development environment, always use debug mode
 
 class GameWorker:
+    # Workers hosting sessions of games with `sessions_per_worker` > 1, by (game type, game id)
+    _hosts: dict[tuple[str, str], list["GameWorker"]] = {}
+    # How long each startup phase took, across all workers of a game, by (game type, game id)
+    startup_phases: dict[tuple[str, str], LatencyTracker] = {}
+    # Running worker processes, which the host's CPUs are split between
+    _processes: list["GameWorker"] = []
+    # Limit each worker process's compute threads to its share of the CPUs (WORKER_CPU_BUDGET=0 to disable),
+    # and pin it to those CPUs (WORKER_CPU_PINNING=1)
+    cpu_budgeting = os.environ.get("WORKER_CPU_BUDGET", "1") != "0"
+    cpu_pinning = os.environ.get("WORKER_CPU_PINNING") == "1"
+
     def __init__(
         self,
         log: BoundLogger,
@@ -52,14 +69,40 @@ class GameWorker:
         self.cleanup_scheduled = False
         
         # Communication handles
-        self.process: Optional[Process] = None
+        self.process: Optional[Process | ForkedProcess] = None
         self.reader: Optional[StreamReader] = None
         self.writer: Optional[StreamWriter] = None
         
         # WebRTC
         self.pc: Optional[RTCPeerConnection] = None
 
-        self.last_log_line: str | None = None
+        # Responses are matched to commands by request id, as the worker may answer them out of order
+        self._next_request_id = 0
+        self._pending: dict[int, asyncio.Future] = {}
+        self._response_task: asyncio.Task | None = None
+
+        # With multiple sessions per worker, the worker whose process this session runs in,
+        # and (for that worker) the sessions currently running in its process
+        self.sessions_per_worker = game_info.sessions_per_worker
+        self.host: GameWorker | None = None
+        self.sessions: set[str] = set()
+        self._process_stopped = False
+
+        # Startup phases reported by the worker, keyed by session id (None for those of the process itself),
+        # as phase -> time.time() it completed
+        self._phases: dict[str | None, dict[str, float]] = {}
+        self._spawned_at: float | None = None
+        # Why the worker process said it was exiting, if it did; an exit without one is a crash
+        self.exit_reason: str | None = None
+
+        # Pre-started by the worker pool and not claimed by a session yet, so it gets no share of the CPUs
+        self.pooled = False
+        # This process's share of the CPUs, and the share the worker was last told about
+        self.cpu_budget: CpuBudget | None = None
+        self._cpu_budget_applied: CpuBudget | None = None
+        # Import times reported by the worker's interpreter (set WORKER_IMPORT_PROFILE=1 to enable)
+        self.import_profile = os.environ.get("WORKER_IMPORT_PROFILE", "0") != "0"
+        self.import_times = ImportTimeReport()
 
     async def _monitor_process_output(self, stream: StreamReader | None, stream_name: str):
         """Monitor output stream of the worker process and log any output"""
@@ -78,10 +121,9 @@ class GameWorker:
                 # Fall back to a more lenient encoding that replaces invalid characters
                 output_line = line.decode('utf-8', errors='replace').rstrip()
             
-            # Store the last non-empty line
-            if output_line.strip():
-                self.last_log_line = output_line
-                
+            if stream_name == "stderr" and self.import_times.feed(output_line):
+                continue
+
             self.log.info(f"Worker {stream_name}", line=output_line)
 
     async def _collect_process_output(self, process: Process) -> tuple[str | None, str | None]:
@@ -114,21 +156,208 @@ class GameWorker:
 
         return stdout_str, stderr_str
 
+    def _entrypoint(self) -> GameEntrypoint | None:
+        """Get the game's resolved entrypoint, if its package metadata is known"""
+        metadata = self.game_info._metadata
+        if metadata is None:
+            return None
+        return GameEntrypoint(
+            entrypoint=metadata.entrypoint,
+            module_dir=metadata._module_dir,
+            game_info=self.game_info,
+        )
+
+    def _entrypoint_args(self) -> list[str]:
+        """Get the worker's resolved-entrypoint argument; without it, the worker scans all packages for the game"""
+        entrypoint = self._entrypoint()
+        return [entrypoint.model_dump_json()] if entrypoint is not None else []
+
+    @staticmethod
+    def _script_path(name: str) -> Path:
+        """Locate a script in the dweam package"""
+        # Use importlib.resources to reliably locate the module file
+        if getattr(sys, 'frozen', False):
+            # In PyInstaller bundle
+            return Path(sys._MEIPASS) / "dweam" / "dweam" / name
+        # In development
+        return Path(str(files('dweam').joinpath(name)))
+
+    def _find_host(self) -> "GameWorker | None":
+        """Find a running worker of the same game with room for another session"""
+        for host in self._hosts.get((self.game_type, self.game_id), []):
+            if (
+                not host._process_stopped
+                and host.process is not None
+                and host.process.returncode is None
+                and len(host.sessions) < self.sessions_per_worker
+            ):
+                return host
+        return None
+
     async def start(self):
         """Start the worker process and establish communication"""
+        if self.sessions_per_worker > 1:
+            host = self._find_host()
+            if host is not None:
+                # Run this session in the existing process
+                self.host = host
+                self.process = host.process
+                host.sessions.add(self.session_id)
+                self.log.info("Placed session in existing worker", pid=host.process.pid, sessions=len(host.sessions))
+                self._rebalance_cpus()
+                return
+            self._hosts.setdefault((self.game_type, self.game_id), []).append(self)
+            self.sessions.add(self.session_id)
+
         if sys.platform == "win32":
             venv_python = self.venv_path / "Scripts" / "python.exe"
         else:
             venv_python = self.venv_path / "bin" / "python"
 
-        # Use importlib.resources to reliably locate the module file
-        if getattr(sys, 'frozen', False):
-            # In PyInstaller bundle
-            worker_script = Path(sys._MEIPASS) / "dweam" / "dweam" / "game_process.py"
-        else:
-            # In development
-            worker_script = files('dweam').joinpath('game_process.py')
-        
+        worker_script = self._script_path("game_process.py")
+        started_at = time.perf_counter()
+        self._spawned_at = time.time()
+        self._processes.append(self)
+        # Spawned workers size their thread pools from the environment; the rest is applied once connected
+        self.cpu_budget = self._plan_cpu_budgets().get(self)
+        try:
+            if sys.platform == "win32":
+                # Sockets can't be handed to a child process here, so the worker connects back over TCP
+                await self._start_over_tcp(venv_python, worker_script)
+            else:
+                await self._start_over_socketpair(venv_python, worker_script)
+        except BaseException:
+            self._processes.remove(self)
+            raise
+        self.log.info("Worker connected", duration_ms=(time.perf_counter() - started_at) * 1000)
+        self._rebalance_cpus()
+
+    @property
+    def _cpu_weight(self) -> int:
+        """The number of sessions running in this worker's process"""
+        if self.pooled:
+            return 0
+        return max(1, len(self.sessions)) if self.is_multi_session else 1
+
+    @classmethod
+    def _plan_cpu_budgets(cls) -> dict["GameWorker", CpuBudget]:
+        """Split the host's CPUs between the running worker processes, by the sessions in each"""
+        if not cls.cpu_budgeting:
+            return {}
+        processes = [
+            worker for worker in cls._processes
+            if worker.process is None or worker.process.returncode is None
+        ]
+        budgets = plan_cpu_budgets(available_cpus(), [worker._cpu_weight for worker in processes], cls.cpu_pinning)
+        return dict(zip(processes, budgets))
+
+    @classmethod
+    def _rebalance_cpus(cls) -> None:
+        """Re-split the CPUs after a process or session has come or gone, telling workers whose share changed"""
+        for worker, budget in cls._plan_cpu_budgets().items():
+            worker.cpu_budget = budget
+            if budget != worker._cpu_budget_applied and worker.writer is not None:
+                worker._cpu_budget_applied = budget
+                asyncio.create_task(worker._apply_cpu_budget(budget))
+
+    async def _apply_cpu_budget(self, budget: CpuBudget) -> None:
+        try:
+            await self._request(CpuBudgetCommand(
+                threads=budget.threads,
+                cpus=list(budget.cpus) if budget.cpus is not None else None,
+            ))
+        except Exception as e:
+            self.log.warning("Failed to set the worker's CPU budget", error=str(e))
+
+    def _worker_args(self, control: str) -> list[str]:
+        """Command line arguments of the worker process, given the argument for its control channel"""
+        return [
+            json.dumps(self.game_type),
+            self.game_id,
+            json.dumps([]),
+            control,
+            *self._entrypoint_args(),
+        ]
+
+    async def _spawn(
+        self,
+        venv_python: Path,
+        worker_script: Path,
+        worker_args: list[str],
+        pass_fds: tuple[int, ...] = (),
+    ) -> Process:
+        self.log.info("Starting worker process",
+                     python=str(venv_python),
+                     script=str(worker_script),
+                     game_type=self.game_type,
+                     game_id=self.game_id)
+        return await asyncio.create_subprocess_exec(
+            str(venv_python),
+            str(worker_script),
+            *worker_args,
+            env={
+                **os.environ,
+                **(self.cpu_budget.env() if self.cpu_budget is not None else {}),
+                **({"PYTHONPROFILEIMPORTTIME": "1"} if self.import_profile else {}),
+            },
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            pass_fds=pass_fds,
+            creationflags=get_asyncio_subprocess_flags()
+        )
+
+    def _monitor_output(self) -> None:
+        assert self.process is not None
+        if isinstance(self.process, ForkedProcess):
+            # Forked workers write to the fork server's output instead
+            return
+        asyncio.create_task(self._monitor_process_output(self.process.stdout, "stdout"))
+        asyncio.create_task(self._monitor_process_output(self.process.stderr, "stderr"))
+
+    async def _start_over_socketpair(self, venv_python: Path, worker_script: Path) -> None:
+        """
+        Start the worker with one end of a connected socket pair as its control channel.
+
+        The channel exists before the worker does, so there's no port to pick and nothing to wait on:
+        commands are buffered until the worker reads them, and a worker that dies early closes its end.
+        """
+        entrypoint = self._entrypoint()
+        # Forking needs the entrypoint, so the template process can preload the game
+        use_fork_server = fork_server_enabled() and entrypoint is not None
+
+        parent_sock, child_sock = socket.socketpair()
+        try:
+            worker_args = self._worker_args(f"fd:{child_sock.fileno()}")
+            if use_fork_server:
+                assert entrypoint is not None
+                # Fork the worker from the game's template process, which has already loaded it
+                fork_server = await get_fork_server(
+                    self.log,
+                    venv_python,
+                    self._script_path("fork_server.py"),
+                    self.game_type,
+                    self.game_id,
+                    entrypoint,
+                )
+                self.process = await fork_server.spawn([str(worker_script), *worker_args], child_sock)
+            else:
+                self.process = await self._spawn(
+                    venv_python, worker_script, worker_args, pass_fds=(child_sock.fileno(),)
+                )
+        except BaseException:
+            parent_sock.close()
+            raise
+        finally:
+            # The worker has its own copy
+            child_sock.close()
+
+        self.reader, self.writer = await asyncio.open_connection(sock=parent_sock)
+        self.log.info("Started worker process", pid=self.process.pid)
+        self._monitor_output()
+
+    async def _start_over_tcp(self, venv_python: Path, worker_script: Path) -> None:
+        """Start the worker and wait for it to connect to a TCP server on the loopback interface"""
         max_retries = 3
         retry_delay = 1.0
 
@@ -158,26 +387,7 @@ class GameWorker:
 
                 self.log.info("Started TCP server", port=port)
                 
-                # Log what we're about to execute
-                self.log.info("Starting worker process", 
-                             python=str(venv_python),
-                             script=str(worker_script),
-                             game_type=self.game_type,
-                             game_id=self.game_id)
-                
-                # Start the worker process with the port number
-                self.process = await asyncio.create_subprocess_exec(
-                    str(venv_python),
-                    str(worker_script),
-                    json.dumps(self.game_type),
-                    self.game_id,
-                    json.dumps([]),
-                    str(port),
-                    stdin=asyncio.subprocess.PIPE,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE,
-                    creationflags=get_asyncio_subprocess_flags()
-                )
+                self.process = await self._spawn(venv_python, worker_script, self._worker_args(str(port)))
                 self.log.info("Started worker process", pid=self.process.pid)
 
                 # Add immediate process status check with timeout
@@ -250,8 +460,7 @@ class GameWorker:
                             raise RuntimeError("No connection received")
                         
                         # Only start monitoring after successful connection
-                        asyncio.create_task(self._monitor_process_output(self.process.stdout, "stdout"))
-                        asyncio.create_task(self._monitor_process_output(self.process.stderr, "stderr"))
+                        self._monitor_output()
                         
                         self.log.info("Client connected")
 
@@ -269,40 +478,146 @@ class GameWorker:
 
         raise RuntimeError(f"Failed to start worker after {max_retries} attempts")
 
-    async def run(self, offer: RTCSessionDescription) -> RTCSessionDescription:
-        """Set up and run the WebRTC connection"""
+    async def prepare(self) -> None:
+        """Start the worker process and construct the game, without waiting for an offer"""
+        if not self.process:
+            await self.start()
+        await self._send_command(PrepareCommand())
+
+    def assign_session(self, session_id: str, log: BoundLogger) -> None:
+        """Hand a pre-started worker over to a new session"""
+        if self.session_id in self.sessions:
+            self.sessions.discard(self.session_id)
+            self.sessions.add(session_id)
+        self.session_id = session_id
+        self.log = log
+        self.pooled = False
+        # Pooled workers aren't pinged while idle, so the session starts from a fresh heartbeat
+        self.last_heartbeat = datetime.now()
+        self._rebalance_cpus()
+
+    @property
+    def is_alive(self) -> bool:
+        """Whether the worker process is running and hasn't been cleaned up"""
+        return (
+            self.process is not None
+            and self.process.returncode is None
+            and not self.cleanup_scheduled
+        )
+
+    @property
+    def is_multi_session(self) -> bool:
+        return self.sessions_per_worker > 1
+
+    async def run(self, offer: RTCSessionDescription, snapshot: Path | None = None) -> RTCSessionDescription:
+        """Set up and run the WebRTC connection, resuming the game from `snapshot` if given"""
         if not self.process:
             await self.start()
 
         # Pass the offer to game process and get answer
         response = await self._send_command(HandleOfferCommand(
             cmd="handle_offer",
-            data=OfferData(sdp=offer.sdp, type=offer.type)
+            data=OfferData(sdp=offer.sdp, type=offer.type),
+            snapshot=snapshot,
         ))
         
+        if self.import_times.modules:
+            self.log.info("Worker import times", **self.import_times.summary())
+
         # Convert response to RTCSessionDescription
         return RTCSessionDescription(sdp=response["sdp"], type=response["type"])
 
     async def _send_command(self, command: Command) -> Any:
-        """Send a command to the worker process and get the response"""
+        """Send a command for this session to the worker process and get the response"""
+        if self.is_multi_session:
+            command.session_id = self.session_id
+        return await (self.host or self)._request(command)
+
+    async def _request(self, command: Command) -> Any:
+        """Send a command over this worker's control channel and wait for its response"""
         if not self.writer or not self.reader:
             raise RuntimeError("Worker process not started")
-        
-        message = command.model_dump_json() + "\n"
-        self.writer.write(message.encode())
-        await self.writer.drain()
-        
-        response = await self.reader.readline()
-        if response == b"":
+        if self._response_task is None:
+            self._response_task = asyncio.create_task(self._read_responses())
+        elif self._response_task.done():
             raise RuntimeError("Worker process closed")
+
+        self._next_request_id += 1
+        command.request_id = self._next_request_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[command.request_id] = future
         
-        self.log.info("Worker response", response=response)
-        result = TypeAdapter(Response).validate_json(response)
+        message = command.model_dump_json() + "\n"
+        try:
+            self.writer.write(message.encode())
+            await self.writer.drain()
+            result = await future
+        finally:
+            self._pending.pop(command.request_id, None)
         
         if isinstance(result, ErrorResponse):
             raise ValueError(result.error)
         return result.data
 
+    async def _read_responses(self) -> None:
+        """Read responses from the worker process, and hand each to the command waiting on it"""
+        assert self.reader is not None
+        try:
+            while True:
+                response = await self.reader.readline()
+                if response == b"":
+                    break
+                self.log.debug("Worker response", response=response)
+                result = TypeAdapter(WorkerMessage).validate_json(response)
+                if isinstance(result, PhaseEvent):
+                    self._record_phase(result)
+                    continue
+                if isinstance(result, ExitEvent):
+                    self.exit_reason = result.reason
+                    self.log.info("Worker exiting", reason=result.reason)
+                    continue
+                future = self._pending.get(result.request_id) if result.request_id is not None else None
+                if future is not None and not future.done():
+                    future.set_result(result)
+        except Exception:
+            self.log.exception("Error reading worker responses")
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError("Worker process closed"))
+
+    def _record_phase(self, event: PhaseEvent) -> None:
+        self._phases.setdefault(event.session_id, {})[event.phase] = event.timestamp
+        duration = event.duration
+        if event.phase == "spawned" and self._spawned_at is not None:
+            # From asking for the process to the worker running, which the worker can't tell itself
+            duration = event.timestamp - self._spawned_at
+        if duration is not None:
+            key = (self.game_type, self.game_id)
+            tracker = self.startup_phases.get(key)
+            if tracker is None:
+                tracker = self.startup_phases[key] = LatencyTracker(STARTUP_PHASES)
+            tracker.record(event.phase, duration)
+        self.log.info("Worker startup phase", phase=event.phase, duration_ms=duration * 1000 if duration is not None else None)
+
+    @property
+    def is_ready(self) -> bool:
+        """Whether the worker process has finished starting up, and reads commands as soon as they arrive"""
+        return "imports_done" in (self.host or self)._phases.get(None, {})
+
+    async def ping(self, timeout: float) -> list[str | None]:
+        """Check the worker process answers within `timeout` seconds, returning the sessions it's running"""
+        data = await asyncio.wait_for((self.host or self)._request(PingCommand()), timeout)
+        return data["sessions"]
+
+    @property
+    def phases(self) -> dict[str, float]:
+        """Startup phases completed for this session so far, as phase -> time.time() it completed"""
+        owner = self.host or self
+        phases = dict(owner._phases.get(None, {}))
+        if self.is_multi_session:
+            phases.update(owner._phases.get(self.session_id, {}))
+        return phases
+
     async def get_params_schema(self) -> dict[str, Any]:
         """Get the JSON schema for game parameters"""
         if not self.process:
@@ -315,16 +630,65 @@ class GameWorker:
             await self.start()
         return await self._send_command(UpdateParamsCommand(data=params))
 
+    async def set_quality(self, tier: str) -> None:
+        """Set the output resolution tier of the video stream"""
+        if not self.process:
+            raise RuntimeError("Worker process not started")
+        return await self._send_command(SetQualityCommand(tier=tier))
+
+    async def suspend(self, path: Path) -> int:
+        """Save the session's game state to `path` and end the session; returns the snapshot's size in bytes"""
+        if not self.process:
+            raise RuntimeError("Worker process not started")
+        data = await self._send_command(SuspendCommand(path=path))
+        return data["bytes"]
+
+    async def get_stats(self) -> dict[str, Any] | None:
+        """Get streaming statistics from the worker"""
+        if not self.process:
+            return None
+        stats = await self._send_command(StatsCommand())
+        if self.import_times.modules:
+            stats["imports"] = self.import_times.summary()
+        return stats
+
     async def cleanup(self):
         """Clean up worker resources"""
         if self.cleanup_scheduled:
             return
         
         self.cleanup_scheduled = True
+        if self.is_multi_session and self.process is not None:
+            owner = self.host or self
+            try:
+                # Stop just this session
+                await self._send_command(StopCommand())
+            except Exception:
+                pass
+            owner.sessions.discard(self.session_id)
+            if owner.sessions:
+                # Other sessions are still running in the process
+                self._rebalance_cpus()
+                return
+            await owner._stop_process()
+            return
+        await self._stop_process()
+
+    async def _stop_process(self):
+        """Stop the worker process, along with every session in it"""
+        if self._process_stopped:
+            return
+        self._process_stopped = True
+        hosts = self._hosts.get((self.game_type, self.game_id))
+        if hosts is not None and self in hosts:
+            hosts.remove(self)
+        if self in self._processes:
+            self._processes.remove(self)
+            self._rebalance_cpus()
         try:
             if self.writer:
                 try:
-                    await self._send_command(StopCommand())
+                    await self._request(StopCommand())
                 except:
                     pass
                 self.writer.close()
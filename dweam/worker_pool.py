@@ -0,0 +1,250 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from structlog.stdlib import BoundLogger
+
+from dweam.models import GameInfo
+from dweam.utils.metrics import LatencyHistogram
+from dweam.utils.venv import get_venv_path
+from dweam.worker import GameWorker
+
+
+GameKey = tuple[str, str]  # (game type, game id)
+
+
+@dataclass
+class IdleWorker:
+    worker: GameWorker
+    ready_at: float  # time.monotonic() when the worker finished preparing
+
+
+@dataclass
+class PoolEntry:
+    """Pool state for a single game"""
+    game_info: GameInfo
+    idle: deque[IdleWorker] = field(default_factory=deque)
+    starting: int = 0
+    claims: deque[float] = field(default_factory=deque)  # time.monotonic() of recent claims
+    hits: int = 0
+    misses: int = 0
+    failures: int = 0
+
+
+class WorkerPool:
+    """
+    Keeps idle, fully initialized workers per game, so an offer can claim one instead of cold-starting.
+
+    The number of idle workers kept for a game follows demand: the number of sessions started for it
+    within the last `DEMAND_WINDOW` seconds, clamped to `[min_size, max_size]`. Games are only pooled
+    once they've been requested. The pool refills in the background, and idle workers beyond the
+    target are stopped after `idle_timeout` seconds. If `has_room` is set, workers are only started
+    while it says the host has room for another one of the game.
+    """
+
+    # How far back claims count towards a game's demand, in seconds
+    DEMAND_WINDOW = 300.0
+    # How often pools are refilled and trimmed, in seconds
+    MAINTAIN_INTERVAL = 5.0
+
+    def __init__(
+        self,
+        log: BoundLogger,
+        min_size: int = 0,
+        max_size: int = 0,
+        idle_timeout: float = 600.0,
+    ):
+        self.log = log.bind(component="worker_pool")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+
+        self._entries: dict[GameKey, PoolEntry] = {}
+        self._startup_times: defaultdict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+        self._task: asyncio.Task | None = None
+        self.has_room: Callable[[GameKey], bool] | None = None
+
+    @classmethod
+    def from_env(cls, log: BoundLogger) -> "WorkerPool":
+        """Configure the pool from `WORKER_POOL_MIN_SIZE`, `WORKER_POOL_MAX_SIZE` and `WORKER_POOL_IDLE_TIMEOUT`"""
+        return cls(
+            log,
+            min_size=int(os.environ.get("WORKER_POOL_MIN_SIZE", 0)),
+            max_size=int(os.environ.get("WORKER_POOL_MAX_SIZE", 0)),
+            idle_timeout=float(os.environ.get("WORKER_POOL_IDLE_TIMEOUT", 600)),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._maintain())
+
+    async def stop(self) -> None:
+        """Stop refilling and clean up all idle workers"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        idle = [idle.worker for entry in self._entries.values() for idle in entry.idle]
+        for entry in self._entries.values():
+            entry.idle.clear()
+        await asyncio.gather(*[worker.cleanup() for worker in idle], return_exceptions=True)
+
+    def target_size(self, key: GameKey) -> int:
+        """Number of idle workers to keep for a game, based on recent demand"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return 0
+        cutoff = time.monotonic() - self.DEMAND_WINDOW
+        while entry.claims and entry.claims[0] < cutoff:
+            entry.claims.popleft()
+        return max(self.min_size, min(self.max_size, len(entry.claims)))
+
+    def claim(
+        self,
+        game_type: str,
+        game_id: str,
+        game_info: GameInfo,
+        session_id: str,
+        log: BoundLogger,
+    ) -> GameWorker | None:
+        """
+        Take an idle worker for a game, handing it over to the session,
+        or return None if there's none ready and the session has to start its own
+        """
+        if not self.enabled or game_info.sessions_per_worker > 1:
+            # Sessions of such games are placed into running workers instead
+            return None
+        key = (game_type, game_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = PoolEntry(game_info=game_info)
+        entry.claims.append(time.monotonic())
+
+        worker = None
+        while entry.idle:
+            candidate = entry.idle.popleft().worker
+            if candidate.is_alive:
+                worker = candidate
+                break
+            # Died while idle
+            entry.failures += 1
+
+        if worker is None:
+            entry.misses += 1
+        else:
+            entry.hits += 1
+            worker.assign_session(session_id, log)
+            log.info("Claimed pooled worker", game_type=game_type, game_id=game_id)
+
+        self._refill(key)
+        return worker
+
+    def idle_count(self, key: GameKey) -> int:
+        """Number of workers ready to be claimed for a game"""
+        entry = self._entries.get(key)
+        return len(entry.idle) if entry is not None else 0
+
+    def reserved(self) -> dict[GameKey, int]:
+        """Number of workers idle or starting for each game, which hold memory without running a session"""
+        return {
+            key: len(entry.idle) + entry.starting
+            for key, entry in self._entries.items()
+            if entry.idle or entry.starting
+        }
+
+    def record_startup(self, hit: bool, duration: float) -> None:
+        """Record how long a session took from its offer to its worker being ready"""
+        self._startup_times["hit" if hit else "miss"].record(duration)
+
+    def _refill(self, key: GameKey) -> None:
+        """Start workers in the background until the game's pool reaches its target size"""
+        entry = self._entries[key]
+        missing = self.target_size(key) - len(entry.idle) - entry.starting
+        for _ in range(max(0, missing)):
+            if self.has_room is not None and not self.has_room(key):
+                break
+            entry.starting += 1
+            asyncio.create_task(self._start_worker(key, entry))
+
+    async def _start_worker(self, key: GameKey, entry: PoolEntry) -> None:
+        game_type, game_id = key
+        session_id = f"pool-{str(uuid.uuid4())[:8]}"
+        log = self.log.bind(session_id=session_id)
+        worker = GameWorker(
+            log=log,
+            game_info=entry.game_info,
+            session_id=session_id,
+            game_type=game_type,
+            game_id=game_id,
+            venv_path=get_venv_path(log),
+        )
+        worker.pooled = True
+        try:
+            await worker.prepare()
+        except Exception:
+            log.exception("Failed to prepare pooled worker", game_type=game_type, game_id=game_id)
+            entry.failures += 1
+            await worker.cleanup()
+            return
+        finally:
+            entry.starting -= 1
+        entry.idle.append(IdleWorker(worker=worker, ready_at=time.monotonic()))
+        log.info("Pooled worker ready", game_type=game_type, game_id=game_id)
+
+    async def _trim(self, key: GameKey) -> None:
+        """Stop dead workers, and idle workers beyond the target size that have waited too long"""
+        entry = self._entries[key]
+        target = self.target_size(key)
+        now = time.monotonic()
+        keep: deque[IdleWorker] = deque()
+        stale: list[GameWorker] = []
+        for idle in entry.idle:
+            if not idle.worker.is_alive:
+                entry.failures += 1
+                stale.append(idle.worker)
+            elif len(keep) >= target and now - idle.ready_at > self.idle_timeout:
+                stale.append(idle.worker)
+            else:
+                keep.append(idle)
+        entry.idle = keep
+        await asyncio.gather(*[worker.cleanup() for worker in stale], return_exceptions=True)
+
+    async def _maintain(self) -> None:
+        while True:
+            await asyncio.sleep(self.MAINTAIN_INTERVAL)
+            for key in list(self._entries):
+                try:
+                    await self._trim(key)
+                    self._refill(key)
+                except Exception:
+                    self.log.exception("Error maintaining worker pool", key=key)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "games": {
+                f"{game_type}/{game_id}": {
+                    "idle": len(entry.idle),
+                    "starting": entry.starting,
+                    "target": self.target_size((game_type, game_id)),
+                    "hits": entry.hits,
+                    "misses": entry.misses,
+                    "failures": entry.failures,
+                }
+                for (game_type, game_id), entry in self._entries.items()
+            },
+            "startup": {kind: histogram.summary() for kind, histogram in self._startup_times.items()},
+        }
@@ -1,6 +1,20 @@
 import { useEffect, useRef, useState } from 'react';
 import { api } from '../../lib/api';
 
+// Binary input protocol: type (u8), key/button code (u16), movement x/y (i16), client timestamp in ms (f64),
+// input sequence number (u32)
+const BINARY_INPUT_PROTOCOL = 'binary-v2';
+const INPUT_MESSAGE_SIZE = 19;
+const INPUT_TYPES = {
+  keydown: 1,
+  keyup: 2,
+  mousemove: 3,
+  mousedown: 4,
+  mouseup: 5,
+} as const;
+
+const clampInt16 = (value: number) => Math.max(-32768, Math.min(32767, Math.round(value)));
+
 interface GameViewReactProps {
   gameType: string;
   gameId: string;
@@ -13,11 +27,17 @@ export default function GameViewReact({ gameType, gameId }: GameViewReactProps)
   const [connectionState, setConnectionState] = useState<'disconnected' | 'connecting' | 'connected'>('disconnected');
   const [loadingMessage, setLoadingMessage] = useState<string | null>(null);
   const [error, setError] = useState<string | null>(null);
+  const [isSuspended, setIsSuspended] = useState(false);
 
   const pcRef = useRef<RTCPeerConnection | null>(null);
   const dataChannelRef = useRef<RTCDataChannel | null>(null);
+  const binaryInputRef = useRef(false);
+  const inputSeqRef = useRef(0);
   const heartbeatIntervalRef = useRef<number | null>(null);
   const abortControllerRef = useRef<AbortController | null>(null);
+  const sessionIdRef = useRef<string | null>(null);
+  // The session to resume on the next play, after the server suspended it while idle
+  const suspendedSessionRef = useRef<string | null>(null);
 
   const cleanup = () => {
     if (heartbeatIntervalRef.current) {
@@ -29,6 +49,8 @@ export default function GameViewReact({ gameType, gameId }: GameViewReactProps)
       dataChannelRef.current.close();
       dataChannelRef.current = null;
     }
+    binaryInputRef.current = false;
+    inputSeqRef.current = 0;
     
     if (pcRef.current) {
       pcRef.current.close();
@@ -54,6 +76,36 @@ export default function GameViewReact({ gameType, gameId }: GameViewReactProps)
     }
   };
 
+  const sendInput = (
+    type: keyof typeof INPUT_TYPES,
+    code: number,
+    dx: number,
+    dy: number,
+    json: Record<string, unknown>
+  ) => {
+    const dataChannel = dataChannelRef.current;
+    if (dataChannel?.readyState !== 'open') return;
+
+    // Lets the worker match each input to the frame that first shows its effect
+    const seq = inputSeqRef.current;
+    inputSeqRef.current = (seq + 1) >>> 0;
+    const timestamp = performance.timeOrigin + performance.now();
+
+    if (!binaryInputRef.current) {
+      dataChannel.send(JSON.stringify({ type, ...json, t: timestamp, seq }));
+      return;
+    }
+
+    const view = new DataView(new ArrayBuffer(INPUT_MESSAGE_SIZE));
+    view.setUint8(0, INPUT_TYPES[type]);
+    view.setUint16(1, code, true);
+    view.setInt16(3, clampInt16(dx), true);
+    view.setInt16(5, clampInt16(dy), true);
+    view.setFloat64(7, timestamp, true);
+    view.setUint32(15, seq, true);
+    dataChannel.send(view.buffer);
+  };
+
   useEffect(() => {
     const handleKeydown = (event: KeyboardEvent) => {
       if (event.key === 'Escape') {
@@ -64,48 +116,31 @@ export default function GameViewReact({ gameType, gameId }: GameViewReactProps)
         event.preventDefault();
       }
 
-      if (dataChannelRef.current?.readyState === 'open') {
-        dataChannelRef.current.send(JSON.stringify({
-          type: 'keydown',
-          key: event.keyCode
-        }));
-      }
+      sendInput('keydown', event.keyCode, 0, 0, { key: event.keyCode });
     };
 
     const handleKeyup = (event: KeyboardEvent) => {
-      if (dataChannelRef.current?.readyState === 'open') {
-        dataChannelRef.current.send(JSON.stringify({
-          type: 'keyup',
-          key: event.keyCode
-        }));
-      }
+      sendInput('keyup', event.keyCode, 0, 0, { key: event.keyCode });
     };
 
     const handleMouseMove = (event: MouseEvent) => {
-      if (isPointerLocked && dataChannelRef.current?.readyState === 'open') {
-        dataChannelRef.current.send(JSON.stringify({
-          type: 'mousemove',
+      if (isPointerLocked) {
+        sendInput('mousemove', 0, event.movementX, event.movementY, {
           movementX: event.movementX,
           movementY: event.movementY
-        }));
+        });
       }
     };
 
     const handleMouseDown = (event: MouseEvent) => {
-      if (isPointerLocked && dataChannelRef.current?.readyState === 'open') {
-        dataChannelRef.current.send(JSON.stringify({
-          type: 'mousedown',
-          button: event.button
-        }));
+      if (isPointerLocked) {
+        sendInput('mousedown', event.button, 0, 0, { button: event.button });
       }
     };
 
     const handleMouseUp = (event: MouseEvent) => {
-      if (isPointerLocked && dataChannelRef.current?.readyState === 'open') {
-        dataChannelRef.current.send(JSON.stringify({
-          type: 'mouseup',
-          button: event.button
-        }));
+      if (isPointerLocked) {
+        sendInput('mouseup', event.button, 0, 0, { button: event.button });
       }
     };
 
@@ -174,7 +209,32 @@ export default function GameViewReact({ gameType, gameId }: GameViewReactProps)
 
     pc.addTransceiver('video', { direction: 'recvonly' });
 
+    dataChannel.binaryType = 'arraybuffer';
+
+    dataChannel.onmessage = (event) => {
+      if (typeof event.data !== 'string') return;
+      const message = JSON.parse(event.data);
+      if (message.type === 'hello') {
+        // The worker picked an input protocol; JSON is used until then
+        binaryInputRef.current = message.protocol === BINARY_INPUT_PROTOCOL;
+      } else if (message.type === 'ping') {
+        // Lets the worker estimate the round trip time and our clock offset
+        dataChannel.send(JSON.stringify({
+          type: 'pong',
+          t: message.t,
+          client_t: performance.timeOrigin + performance.now(),
+        }));
+      } else if (message.type === 'latency') {
+        window.dispatchEvent(new CustomEvent('gameLatency', { detail: message.stages }));
+      } else if (message.type === 'suspended') {
+        suspendedSessionRef.current = sessionIdRef.current;
+        setIsSuspended(true);
+        cleanup();
+      }
+    };
+
     dataChannel.onopen = () => {
+      dataChannel.send(JSON.stringify({ type: 'hello', protocols: [BINARY_INPUT_PROTOCOL, 'json'] }));
       heartbeatIntervalRef.current = window.setInterval(() => {
         if (dataChannel?.readyState === 'open') {
           dataChannel.send(JSON.stringify({ type: 'heartbeat' }));
@@ -229,13 +289,17 @@ export default function GameViewReact({ gameType, gameId }: GameViewReactProps)
         gameId,
         {
           sdp: pc.localDescription!.sdp,
-          type: pc.localDescription!.type
+          type: pc.localDescription!.type,
+          resume: suspendedSessionRef.current ?? undefined,
         },
         setLoadingMessage,
         abortControllerRef.current.signal
       );
 
       await pc.setRemoteDescription(new RTCSessionDescription(response));
+      sessionIdRef.current = response.sessionId;
+      suspendedSessionRef.current = null;
+      setIsSuspended(false);
       
       window.dispatchEvent(new CustomEvent('gameSessionReady', {
         detail: { sessionId: response.sessionId }
@@ -282,6 +346,13 @@ export default function GameViewReact({ gameType, gameId }: GameViewReactProps)
                   {error}
                 </div>
               </>
+            ) : isSuspended ? (
+              <>
+                <div className="mb-4">▶</div>
+                <div className="text-sm font-mono opacity-75 max-w-md text-center px-4">
+                  Paused while you were away. Click to resume.
+                </div>
+              </>
             ) : (
               '▶'
             )}
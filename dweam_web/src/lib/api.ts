@@ -25,6 +25,14 @@ const getBaseUrl = () => {
   return 'http://localhost:8080';
 };
 
+// Shown while a session starts, once the worker reports each startup phase as done
+const STARTUP_PHASE_MESSAGES: Record<string, string> = {
+  spawned: 'Loading game code...',
+  imports_done: 'Loading game...',
+  model_loaded: 'Starting game...',
+  answer_ready: 'Connecting...',
+};
+
 type RequestOptions = RequestInit & {
   params?: Record<string, string>;
 };
@@ -132,8 +140,17 @@ class ApiClient {
           if (event.event === 'error') {
             reject(new Error(event.data));
           }
-          else if (event.event === 'loading') {
-            onLoadingMessage?.(event.data.trim());
+          else if (event.event === 'queue') {
+            const { position, eta } = JSON.parse(event.data);
+            const wait = eta == null ? '' : `, about ${Math.max(1, Math.round(eta / 60))} min`;
+            onLoadingMessage?.(`Waiting for a free slot (${position} in queue${wait})...`);
+          }
+          else if (event.event === 'phase') {
+            const { phase } = JSON.parse(event.data);
+            const message = STARTUP_PHASE_MESSAGES[phase];
+            if (message) {
+              onLoadingMessage?.(message);
+            }
           }
           else if (event.event === 'answer') {
             try {
@@ -0,0 +1,78 @@
+import time
+from collections import deque
+from pathlib import Path
+
+from dweam.admission import AdmissionController
+from dweam.log_config import get_logger
+from dweam.models import GameInfo
+from dweam.worker import GameWorker
+from dweam.worker_pool import IdleWorker, PoolEntry, WorkerPool
+
+
+KEY = ("test", "game")
+
+
+def make_worker(session_id: str) -> GameWorker:
+    return GameWorker(
+        log=get_logger(),
+        game_info=GameInfo(),
+        session_id=session_id,
+        game_type=KEY[0],
+        game_id=KEY[1],
+        venv_path=Path("venv"),
+    )
+
+
+def make_admission(idle: int) -> tuple[AdmissionController, WorkerPool]:
+    """Room for two default-sized sessions, with `idle` workers of the game ready in the pool"""
+    pool = WorkerPool(get_logger())
+    pool._entries[KEY] = PoolEntry(
+        game_info=GameInfo(),
+        idle=deque(IdleWorker(make_worker(f"pooled-{i}"), ready_at=time.monotonic()) for i in range(idle)),
+    )
+    admission = AdmissionController(get_logger(), memory_mb=4096, cores=8, pool=pool)
+    return admission, pool
+
+
+def test_sessions_claiming_pooled_workers_are_admitted():
+    admission, _ = make_admission(idle=2)
+    first = admission.request("first", *KEY)
+    second = admission.request("second", *KEY)
+    third = admission.request("third", *KEY)
+
+    # The idle workers' memory is already charged, and each of the first two sessions takes one over
+    assert first.admitted.is_set() and second.admitted.is_set()
+    assert admission.usage() == (4096, 2)
+    # No idle worker is left for the third, which would need memory of its own
+    assert not third.admitted.is_set()
+    assert admission.position(third) == 1
+    assert not admission.has_room_for_pooled(KEY)
+
+
+def test_claiming_a_pooled_worker_keeps_its_memory_charged_once():
+    admission, pool = make_admission(idle=2)
+    first = admission.request("first", *KEY)
+    admission.request("second", *KEY)
+
+    pool._entries[KEY].idle.popleft()
+    admission.attach("first", make_worker("first"))
+    assert first.worker is not None
+    assert admission.usage() == (4096, 2)
+
+
+def test_eta_once_a_session_has_ended():
+    admission, pool = make_admission(idle=1)
+    admission.request("first", *KEY)
+    admission.request("second", *KEY)
+    third = admission.request("third", *KEY)
+    fourth = admission.request("fourth", *KEY)
+
+    # The pooled worker's memory is counted, so only one session fits beyond the one claiming it
+    assert admission.position(third) == 1 and admission.position(fourth) == 2
+    assert admission.eta(fourth) is None
+
+    pool._entries[KEY].idle.popleft()
+    admission.release("first")
+    assert third.admitted.is_set() and admission.eta(third) == 0.0
+    assert admission._session_duration is not None
+    assert admission.eta(fourth) == admission._session_duration / 2
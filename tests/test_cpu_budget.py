@@ -0,0 +1,65 @@
+from pathlib import Path
+
+from dweam.log_config import get_logger
+from dweam.models import GameInfo
+from dweam.utils.cpu import CpuBudget, plan_cpu_budgets
+from dweam.worker import GameWorker
+
+
+def make_worker(session_id: str, sessions_per_worker: int = 1) -> GameWorker:
+    return GameWorker(
+        log=get_logger(),
+        game_info=GameInfo(sessions_per_worker=sessions_per_worker),
+        session_id=session_id,
+        game_type="test",
+        game_id="game",
+        venv_path=Path("venv"),
+    )
+
+
+def test_cpus_are_split_by_sessions():
+    assert plan_cpu_budgets(list(range(6)), [2, 1], pin=True) == [
+        CpuBudget(threads=4, cpus=(0, 1, 2, 3)),
+        CpuBudget(threads=2, cpus=(4, 5)),
+    ]
+    assert plan_cpu_budgets(list(range(6)), [2, 1]) == [CpuBudget(threads=4), CpuBudget(threads=2)]
+
+
+def test_idle_processes_get_a_single_unpinned_thread():
+    assert plan_cpu_budgets(list(range(4)), [0, 1, 0], pin=True) == [
+        CpuBudget(threads=1),
+        CpuBudget(threads=4, cpus=(0, 1, 2, 3)),
+        CpuBudget(threads=1),
+    ]
+    assert plan_cpu_budgets(list(range(4)), [0, 0]) == [CpuBudget(threads=1), CpuBudget(threads=1)]
+
+
+def test_oversubscribed_cpus_are_shared():
+    assert plan_cpu_budgets([0, 1], [1, 1, 2], pin=True) == [
+        CpuBudget(threads=1),
+        CpuBudget(threads=1),
+        CpuBudget(threads=1),
+    ]
+
+
+def test_pooled_and_multi_session_workers(monkeypatch):
+    pooled = make_worker("pooled")
+    pooled.pooled = True
+    host = make_worker("host", sessions_per_worker=4)
+    host.sessions = {"a", "b", "c"}
+    single = make_worker("single")
+    monkeypatch.setattr(GameWorker, "_processes", [pooled, host, single])
+    monkeypatch.setattr(GameWorker, "cpu_budgeting", True)
+    monkeypatch.setattr(GameWorker, "cpu_pinning", False)
+    monkeypatch.setattr("dweam.worker.available_cpus", lambda: list(range(8)))
+
+    budgets = GameWorker._plan_cpu_budgets()
+    assert budgets[pooled] == CpuBudget(threads=1)
+    assert budgets[host] == CpuBudget(threads=6)
+    assert budgets[single] == CpuBudget(threads=2)
+
+    # Once claimed, the pooled worker's session gets its share
+    pooled.assign_session("claimed", get_logger())
+    assert pooled.cpu_budget == CpuBudget(threads=1)
+    assert host.cpu_budget == CpuBudget(threads=5)
+    assert single.cpu_budget == CpuBudget(threads=2)
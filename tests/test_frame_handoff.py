@@ -0,0 +1,75 @@
+import asyncio
+
+import numpy as np
+import pygame
+
+from dweam.game import Game
+from dweam.log_config import get_logger
+from dweam.rtc import GameVideoTrack
+from dweam.utils.mailbox import FrameMailbox
+
+
+class ScreenGame(Game):
+    """A game that keeps drawing to the same surface, as most pygame games do"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.screen = pygame.Surface((640, 480))
+        self.tile = pygame.Surface((64, 64))
+        self.steps = 0
+        self.configure_frame_rate(fps=60)
+
+    def step(self):
+        self.steps += 1
+        for x in range(0, 640, 64):
+            for y in range(0, 480, 64):
+                self.tile.fill(((x + self.steps) % 256, y % 256, self.steps % 256))
+                self.screen.blit(self.tile, (x, y))
+        return self.screen
+
+
+def test_surfaces_are_copied_before_hand_off():
+    async def run() -> tuple[list[type], ScreenGame, bool]:
+        game = ScreenGame(log=get_logger(), game_id="test")
+        track = GameVideoTrack(game)
+        seen: list[type] = []
+        prepare = track._prepare
+
+        def recording_prepare(game_frame, scale):
+            seen.append(type(game_frame.image))
+            return prepare(game_frame, scale)
+
+        track._prepare = recording_prepare
+        game.start()
+        # Converting on the frame-prep thread while the game draws mustn't break the game loop
+        prepare_task = asyncio.create_task(track._prepare_frames())
+        try:
+            await asyncio.sleep(1.0)
+            running = game.is_running
+        finally:
+            prepare_task.cancel()
+            game.stop()
+            track.stop()
+        return seen, game, running
+
+    seen, game, running = asyncio.run(run())
+    assert seen and all(image_type is np.ndarray for image_type in seen)
+    assert game.error is None and running
+
+
+def test_frame_buffers_are_reused_only_once_released():
+    game = ScreenGame(log=get_logger(), game_id="test")
+    mailbox = FrameMailbox()
+
+    def hand_off() -> np.ndarray:
+        image, on_release = game._copy_frame(game.step())
+        mailbox.put(image, on_release=on_release)
+        return image
+
+    taken = hand_off()
+    assert mailbox.take_nowait().image is taken
+    overwritten = hand_off()
+    hand_off()
+    # The overwritten frame was never read, so its buffer is reused; the taken one is still being read
+    assert hand_off() is overwritten
+    assert hand_off() is not taken
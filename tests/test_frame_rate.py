@@ -0,0 +1,38 @@
+import asyncio
+
+import numpy as np
+
+from dweam.game import Game
+from dweam.log_config import get_logger
+from dweam.rtc import GameVideoTrack
+from dweam.utils.pacing import FrameRateGovernor
+
+
+class BusyGame(Game):
+    """A game whose every frame is new, so each one has to be encoded"""
+
+    def step(self):
+        self.frame_changed = True
+        return np.zeros((64, 64, 3), np.uint8)
+
+
+def test_slow_encoder_lowers_frame_rate(monkeypatch):
+    monkeypatch.setattr(FrameRateGovernor, "UPDATE_INTERVAL", 0.1)
+
+    async def run() -> tuple[GameVideoTrack, Game]:
+        game = BusyGame(log=get_logger(), game_id="test")
+        track = GameVideoTrack(game)
+        game.start()
+        # Frames are converted as they're produced, but the encoder never takes any
+        prepare_task = asyncio.create_task(track._prepare_frames())
+        try:
+            await asyncio.sleep(1.5)
+        finally:
+            prepare_task.cancel()
+            game.stop()
+            track.stop()
+        return track, game
+
+    track, game = asyncio.run(run())
+    assert track.prepared_dropped > 0
+    assert game.frame_rate.fps < game.frame_rate.target_fps